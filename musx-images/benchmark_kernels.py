@@ -0,0 +1,60 @@
+"""Benchmark for the musx_images walk kernels.
+
+Times each kernel compiled with Numba against its plain Python version on the same input and checks that both
+give identical results. Without Numba installed only the plain Python timings are reported.
+
+Usage:
+    python benchmark_kernels.py [--steps STEPS] [--repeat REPEAT]
+"""
+
+import argparse
+import time
+
+import numpy as np
+import musx_images
+
+
+
+def best_time(function, args, repeat):
+    """Runs function repeat times and returns the fastest run in seconds along with its result.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare compiled and plain Python musx_images walk kernels.")
+    parser.add_argument("--steps", type=int, default=1000000, help="steps per walk")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per kernel, the fastest is reported")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed)
+    steps = np.column_stack((rng.integers(-3, 4, args.steps), rng.integers(-3, 4, args.steps)))
+    kernels = {
+        "clamp_walk": (musx_images._clamp_walk, (steps, 50, 50, 480, 640)),
+        "traversal_walk": (musx_images._traversal_walk, (args.steps, True, 0, 0, 480, 640, 1, 1, 0, 1)),
+    }
+
+    print("numba {}".format("not installed" if musx_images.numba is None else musx_images.numba.__version__))
+    for name, (kernel, kernel_args) in kernels.items():
+        python_kernel = getattr(kernel, "py_func", kernel)
+        python_time, python_result = best_time(python_kernel, kernel_args, args.repeat)
+        if python_kernel is kernel:
+            print("{:<16} python {:8.1f} ms".format(name, python_time * 1000))
+            continue
+
+        # First call compiles, keep it out of the timings
+        kernel(*kernel_args)
+        compiled_time, compiled_result = best_time(kernel, kernel_args, args.repeat)
+        print("{:<16} python {:8.1f} ms  numba {:8.1f} ms  speedup {:6.1f}x  identical {}".format(
+            name, python_time * 1000, compiled_time * 1000, python_time / compiled_time, np.array_equal(python_result, compiled_result)))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,28 @@
+import collections
+import concurrent.futures
+import math
 import musx
 import musx_images
 import cv2 as cv
 import numpy as np
 from matplotlib import pyplot as plt
+import multiprocessing
+from multiprocessing import resource_tracker, shared_memory
+import os
+import queue as queue_module
 import sys
+import time
+import weakref
+
+try:
+    import numba
+except ImportError: # numba is only needed to compile the walk kernels, they run as plain Python without it
+    numba = None
+
+try:
+    import resource
+except ImportError: # resource is POSIX only, worker memory limits are skipped elsewhere
+    resource = None
 
 
 
@@ -17,9 +36,45 @@ valid_color_spaces = ["BGR", "Gray", "HLS", "HLS_FULL", "HSV", "HSV_FULL", "Lab"
 "List of valid interpolation methods, used for error handling."
 valid_interpolations = ["INTER_NEAREST", "INTER_LINEAR", "INTER_CUBIC", "INTER_AREA", "INTER_LINEAR_EXACT", "INTER_NEAREST_EXACT", "INTER_MAX"]
 
+"OpenCV interpolation flags of the valid interpolation methods, used for error handling."
+valid_interpolation_flags = [getattr(cv, interpolation) for interpolation in valid_interpolations]
+
+"List of valid feature planes, used for error handling."
+valid_features = ["magnitude", "orientation", "edges"]
+
+"List of valid flows for flow_field, used for error handling."
+valid_flows = ["uphill", "downhill", "edge"]
+
+"List of valid walks for stream_2d, used for error handling."
+valid_walks = ["traversal", "random", "drunk"]
+
+"Number of locations traversal_2d steps at once with its kernel."
+walk_block_size = 1024
+
 "Global array used for caching accessed locations in the 2D generators"
 points_cache = []
 
+"Queues that the 2D generators put visited locations on, see subscribe_points."
+_point_subscribers = []
+
+"Cached preview pyramids and fitted previews, by id of the image they were built from, along with a weak reference to that image."
+_preview_pyramids = {}
+
+"Figures and axes reused by display_preview, by number of images."
+_preview_figures = {}
+
+"Cached feature planes, by id of the image they were computed from, along with a weak reference to that image."
+_feature_cache = {}
+
+"Cached flow fields, by id of the image they were computed from, along with a weak reference to that image."
+_field_cache = {}
+
+"Cached palettes and palette index planes, by id of the image they were computed from, along with a weak reference to that image."
+_palette_cache = {}
+
+"Images this process has attached to through ImageHandle.attach, by handle name."
+_attached_images = {}
+
 
 
 # ---------------------------- #
@@ -140,11 +195,14 @@ def randomize_color_space(img, iterations=1, *, final_color_space=None):
     return converted_img
 
 
-def display_image(img):
+def display_image(img, *, preview=False):
     """Wrapper on matplotlib's imshow function.
+    In preview mode the image is shrunk to about the figure's pixel size first and the figure is reused between calls,
+    see display_preview.
 
     Arguments:
         img: 2D or 3D number Numpy array, image to display, assumes grayscale or RGB format
+        preview: boolean, whether to display a downsampled preview, defaults to False
     
     Raises:
         ValueError: image has too few or too many dimensions
@@ -152,6 +210,10 @@ def display_image(img):
     if len(img.shape) != 2 and len(img.shape) != 3:
         raise ValueError ("Image is not two or three dimensional")
 
+    if preview:
+        display_preview([img])
+        return
+
     fig, axes = plt.subplots(1, 1, figsize=(10, 10))
 
     if len(img.shape) == 2:
@@ -186,19 +248,26 @@ def points_image(img, points, *, enlarge=25):
     return p_image
 
 
-def display_images(imgs):
+def display_images(imgs, *, preview=False):
     """Wrapper on matplotlib's imshow function.
+    In preview mode the images are shrunk to about the figure's pixel size first and the figure is reused between calls,
+    see display_preview.
 
     Arguments:
         img: list of 2D or 3D number Numpy arrays, image to display, assumes grayscale or RGB format
         grayscale: boolean list, flag for if image is grayscale or not, defaults to None
+        preview: boolean, whether to display downsampled previews, defaults to False
     
     Raises:
         ValueError: an image has too few or too many dimensions
     """
     for index in range(len(imgs)):
         if len(imgs[index].shape) != 2 and len(imgs[index].shape) != 3:
-        raise ValueError ("An image is not two or three dimensional")
+            raise ValueError ("An image is not two or three dimensional")
+
+    if preview:
+        display_preview(imgs)
+        return
 
     fig, axes = plt.subplots(1, len(imgs), figsize=(10 * len(imgs), 10))
 
@@ -211,6 +280,88 @@ def display_images(imgs):
             cur_plt.imshow(imgs[index])
 
 
+def display_preview(imgs):
+    """Displays images side by side at roughly the resolution they will be drawn at.
+    Each image is shrunk to the pixel size of its axes, starting from the closest level of a cached cv.INTER_AREA
+    half-size pyramid, so huge images are never handed to matplotlib whole. The figure and axes
+    are kept and reused by the next preview of the same number of images, which, with an interactive backend
+    (e.g. %matplotlib widget), makes a redraw only swap the image data.
+    Pyramids are cached per image object and built lazily, changes made in place to an image after its first
+    preview are not picked up.
+
+    Arguments:
+        imgs: list of 2D or 3D number Numpy arrays, images to display, assumes grayscale or RGB format
+
+    Returns:
+        matplotlib Figure object, the figure drawn to
+    """
+    fig, axes = _preview_figure(len(imgs))
+
+    for cur_plt, img in zip(axes, imgs):
+        extent = cur_plt.get_window_extent()
+        level = _preview_level(img, max(1, round(extent.width)), max(1, round(extent.height)))
+        if cur_plt.images and cur_plt.images[0].get_array().shape == level.shape:
+            # Same size as last time, only the pixels need replacing
+            cur_plt.images[0].set_data(level)
+            if len(level.shape) == 2:
+                cur_plt.images[0].autoscale()
+        else:
+            cur_plt.clear()
+            if len(level.shape) == 2:
+                cur_plt.imshow(level, cmap='gray')
+            else:
+                cur_plt.imshow(level)
+
+    fig.canvas.draw_idle()
+    return fig
+
+
+def _preview_level(img, width, height):
+    """Shrinks an image to fit within width x height pixels, from the smallest pyramid level that still covers them.
+    Pyramid levels are computed as they are first needed, and kept along with the fitted previews.
+    """
+    scale = min(width / img.shape[1], height / img.shape[0])
+    if scale >= 1:
+        return img
+
+    computed = _image_cache(_preview_pyramids, img)
+    # Level 0 is the image itself, only the smaller levels are kept so the cache does not keep it alive
+    levels = computed.setdefault("levels", [])
+
+    size = (max(1, round(img.shape[1] * scale)), max(1, round(img.shape[0] * scale)))
+    if size not in computed:
+        level = img
+        for depth in range(int(math.log2(1 / scale))):
+            if depth == len(levels):
+                levels.append(cv.resize(level, (max(1, level.shape[1] // 2), max(1, level.shape[0] // 2)), interpolation=cv.INTER_AREA))
+            level = levels[depth]
+        computed[size] = cv.resize(level, size, interpolation=cv.INTER_AREA)
+    return computed[size]
+
+
+def _image_cache(cache, img):
+    """Gets the dictionary of things computed from an image in one of the per-image caches, keyed by the image's id.
+    The cache holds only a weak reference to the image, its entry is dropped when the image is garbage collected.
+    """
+    key = id(img)
+    entry = cache.get(key)
+    if entry is None or entry[0]() is not img:
+        entry = (weakref.ref(img, lambda ref: cache.pop(key, None)), {})
+        cache[key] = entry
+    return entry[1]
+
+
+def _preview_figure(count):
+    """Gets the preview figure for count images, making a new one if there is none or it has been closed.
+    """
+    entry = _preview_figures.get(count)
+    if entry is None or not plt.fignum_exists(entry[0].number):
+        fig, axes = plt.subplots(1, count, figsize=(10 * count, 10), squeeze=False)
+        entry = (fig, list(axes[0]))
+        _preview_figures[count] = entry
+    return entry
+
+
 def shrink_image(img, shrink_factor, *, interpolation_mode=cv.INTER_AREA):
     """Shrinks an image by a given factor.
     Documentation recommends use of cv.INTER_AREA interpolation.
@@ -226,7 +377,7 @@ def shrink_image(img, shrink_factor, *, interpolation_mode=cv.INTER_AREA):
     Raises:
         ValueError: unknown interpolation mode, incorrect shrink factor or an image has too few or too many dimensions
     """
-    if interpolation_mode not in valid_interpolations:
+    if interpolation_mode not in valid_interpolation_flags:
         raise ValueError ("Specified interpolation '{}' is not in supported list of interpolations: {}".format(interpolation_mode, ', '.join(valid_interpolations)))
 
     if shrink_factor <= 0:
@@ -258,7 +409,7 @@ def enlarge_image(img, enlarge_factor, *, interpolation_mode=cv.INTER_LINEAR):
     Raises:
         ValueError: unknown interpolation mode, incorrect shrink factor or an image has too few or too many dimensions
     """
-    if interpolation_mode not in valid_interpolations:
+    if interpolation_mode not in valid_interpolation_flags:
         raise ValueError ("Specified interpolation '{}' is not in supported list of interpolations: {}".format(interpolation_mode, ', '.join(valid_interpolations)))
 
     if enlarge_factor < 1.0:
@@ -287,10 +438,10 @@ def blur_image(img, intensity, *, shrink_interp_mode=cv.INTER_AREA, enlarge_inte
     Raises:
         ValueError: unknown interpolation mode, incorrect shrink factor or an image has too few or too many dimensions
     """
-    if shrink_interp_mode not in valid_interpolations:
+    if shrink_interp_mode not in valid_interpolation_flags:
         raise ValueError ("Specified interpolation '{}' is not in supported list of interpolations: {}".format(shrink_interp_mode, ', '.join(valid_interpolations)))
 
-    if enlarge_interp_mode not in valid_interpolations:
+    if enlarge_interp_mode not in valid_interpolation_flags:
         raise ValueError ("Specified interpolation '{}' is not in supported list of interpolations: {}".format(enlarge_interp_mode, ', '.join(valid_interpolations)))
 
     if intensity < 1.0:
@@ -304,14 +455,325 @@ def blur_image(img, intensity, *, shrink_interp_mode=cv.INTER_AREA, enlarge_inte
 
 
 
+# ----------------------- #
+# Image Feature Functions #
+# ----------------------- #
+
+def image_features(img, *, features=("magnitude", "orientation", "edges"), orientation_bins=8, window=9):
+    """Computes texture feature planes of an image, to sonify texture rather than raw color.
+    Every plane has the image's height and width and is scaled to 0-255, and the planes are stacked as channels,
+    so the result can be walked by any 2D generator like an image. Results are cached per image object.
+        magnitude: log magnitude of the image's centered 2D Fourier transform
+        orientation: dominant gradient orientation in the surrounding window, from a magnitude weighted histogram
+        edges: gradient energy averaged over the surrounding window
+
+    Arguments:
+        img: 2D or 3D number Numpy array, image to analyze, assumes grayscale or RGB format
+        features: tuple of strings, feature planes to compute in order, defaults to all of them
+        orientation_bins: int, number of orientation histogram bins over 0-180 degrees, defaults to 8
+        window: int, side of the square neighborhood orientation and edges are gathered over, defaults to 9
+
+    Returns:
+        3D uint8 Numpy array, read-only, whose dimensions represent x-coord, y-coord, feature
+
+    Raises:
+        ValueError: unknown feature, too few orientation bins or an image has too few or too many dimensions
+    """
+    for feature in features:
+        if feature not in valid_features:
+            raise ValueError ("Specified feature '{}' is not in supported list of features: {}".format(feature, ', '.join(valid_features)))
+
+    if orientation_bins < 2:
+        raise ValueError ("Number of orientation bins must be 2 or greater")
+
+    if len(img.shape) != 2 and len(img.shape) != 3:
+        raise ValueError ("Image is not two or three dimensional")
+
+    computed = _image_cache(_feature_cache, img)
+
+    settings = (tuple(features), orientation_bins, window)
+    if settings not in computed:
+        gray = img if len(img.shape) == 2 else cv.cvtColor(img, cv.COLOR_RGB2GRAY)
+        gray = gray.astype(np.float32)
+        planes = []
+        for feature in features:
+            if feature == "magnitude":
+                planes.append(_fft_magnitude(gray))
+            elif feature == "orientation":
+                planes.append(_orientation(gray, orientation_bins, window))
+            else:
+                planes.append(_edge_energy(gray, window))
+        stacked = np.dstack(planes)
+        stacked.flags.writeable = False
+        computed[settings] = stacked
+    return computed[settings]
+
+
+def flow_field(img, *, follow="uphill", operator="sobel", smooth=2.0):
+    """Computes a field of unit step directions for walkers to follow, cached per image object.
+    The field has the image's height and width and two channels, the row and column component of the direction.
+        uphill: along the brightness gradient, towards brighter pixels
+        downhill: against the brightness gradient, towards darker pixels
+        edge: along edges, across the dominant gradient orientation of the structure tensor
+    Flat areas have no direction and are left as zero vectors.
+
+    Arguments:
+        img: 2D or 3D number Numpy array, image to follow, assumes grayscale or RGB format
+        follow: string, one of "uphill", "downhill" or "edge", defaults to uphill
+        operator: string, "sobel" or "scharr" derivative filter, defaults to sobel
+        smooth: number, standard deviation of the Gaussian blur applied before differentiating, 0 for none, defaults to 2
+
+    Returns:
+        3D float32 Numpy array, read-only, whose dimensions represent x-coord, y-coord, (row step, column step)
+
+    Raises:
+        ValueError: unknown flow or operator, or an image has too few or too many dimensions
+    """
+    if follow not in valid_flows:
+        raise ValueError ("Specified flow '{}' is not in supported list of flows: {}".format(follow, ', '.join(valid_flows)))
+
+    if operator not in ["sobel", "scharr"]:
+        raise ValueError ("Specified operator '{}' is not one of sobel or scharr".format(operator))
+
+    if len(img.shape) != 2 and len(img.shape) != 3:
+        raise ValueError ("Image is not two or three dimensional")
+
+    computed = _image_cache(_field_cache, img)
+    settings = (follow, operator, smooth)
+    if settings not in computed:
+        gray = img if len(img.shape) == 2 else cv.cvtColor(img, cv.COLOR_RGB2GRAY)
+        gray = gray.astype(np.float32)
+        if smooth > 0:
+            gray = cv.GaussianBlur(gray, (0, 0), smooth)
+        if operator == "scharr":
+            gx = cv.Scharr(gray, cv.CV_32F, 1, 0)
+            gy = cv.Scharr(gray, cv.CV_32F, 0, 1)
+        else:
+            gx = cv.Sobel(gray, cv.CV_32F, 1, 0)
+            gy = cv.Sobel(gray, cv.CV_32F, 0, 1)
+
+        if follow == "edge":
+            sigma = max(smooth, 1.0)
+            jxx = cv.GaussianBlur(gx * gx, (0, 0), sigma)
+            jyy = cv.GaussianBlur(gy * gy, (0, 0), sigma)
+            jxy = cv.GaussianBlur(gx * gy, (0, 0), sigma)
+            # Dominant gradient orientation, edges run perpendicular to it
+            angle = 0.5 * np.arctan2(2 * jxy, jxx - jyy) + np.pi / 2
+            textured = (jxx + jyy) > 1e-6
+            field = np.dstack((np.where(textured, np.sin(angle), 0), np.where(textured, np.cos(angle), 0)))
+        else:
+            magnitude = cv.magnitude(gx, gy)
+            sign = 1 if follow == "uphill" else -1
+            scale = np.divide(sign, magnitude, out=np.zeros_like(magnitude), where=magnitude > 1e-6)
+            field = np.dstack((gy * scale, gx * scale))
+
+        field = field.astype(np.float32)
+        field.flags.writeable = False
+        computed[settings] = field
+    return computed[settings]
+
+
+def palette_index(img, k=8, *, sample_side=256, attempts=3, seed=None):
+    """Quantizes an image's colors into a k color palette and labels every pixel with its palette entry.
+    The palette is found with k-means on a copy shrunk to at most sample_side pixels a side, then every pixel of the
+    full image is assigned its nearest palette color. Entries are ordered from darkest to brightest, so IDs can be
+    mapped to pitch directly. Results are cached per image object, walk the index plane with any 2D generator to
+    get palette IDs and look chords up with palette_chords.
+
+    Arguments:
+        img: 2D or 3D number Numpy array, image to quantize
+        k: int, number of palette entries (2-256), defaults to 8
+        sample_side: int, longest side of the copy the palette is clustered on, defaults to 256
+        attempts: int, number of k-means runs, the most compact is kept, defaults to 3
+        seed: int, seed of the k-means++ initialization, defaults to one drawn from musx's random stream
+
+    Returns:
+        2D float32 Numpy array of k palette colors by channel, and 2D uint8 Numpy array of palette IDs with the
+        image's height and width, both read-only
+
+    Raises:
+        ValueError: k is out of range or an image has too few or too many dimensions
+    """
+    if k < 2 or k > 256:
+        raise ValueError ("Number of palette entries must be between 2 and 256")
+
+    if len(img.shape) != 2 and len(img.shape) != 3:
+        raise ValueError ("Image is not two or three dimensional")
+
+    computed = _image_cache(_palette_cache, img)
+    settings = (k, sample_side, attempts, seed)
+    if settings not in computed:
+        pixels = img.reshape(img.shape[0], img.shape[1], -1).astype(np.float32)
+        scale = sample_side / max(img.shape[:2])
+        sample = pixels if scale >= 1 else cv.resize(pixels, (max(1, round(img.shape[1] * scale)), max(1, round(img.shape[0] * scale))), interpolation=cv.INTER_AREA)
+        sample = sample.reshape(-1, pixels.shape[2])
+
+        # Initial labels come from a local generator, so OpenCV's process-wide RNG is never seeded or drawn from
+        rng = np.random.default_rng(int(musx.uniran() * 2**31) if seed is None else seed)
+        criteria = (cv.TERM_CRITERIA_EPS + cv.TERM_CRITERIA_MAX_ITER, 20, 1.0)
+        best = None
+        for _ in range(attempts):
+            labels = _kmeans_pp_labels(sample, min(k, len(sample)), rng)
+            compactness, _, centers = cv.kmeans(sample, min(k, len(sample)), labels, criteria, 1, cv.KMEANS_USE_INITIAL_LABELS)
+            if best is None or compactness < best[0]:
+                best = (compactness, centers)
+        centers = best[1]
+        palette = centers[np.argsort(centers.sum(axis=1), kind="stable")]
+
+        # Nearest palette color per pixel, one palette entry at a time to keep memory at a couple of planes
+        index = np.zeros(img.shape[:2], dtype=np.uint8)
+        nearest = np.full(img.shape[:2], np.inf, dtype=np.float32)
+        for entry, color in enumerate(palette):
+            distance = ((pixels - color) ** 2).sum(axis=2)
+            closer = distance < nearest
+            nearest[closer] = distance[closer]
+            index[closer] = entry
+
+        palette.flags.writeable = False
+        index.flags.writeable = False
+        computed[settings] = (palette, index)
+    return computed[settings]
+
+
+def _kmeans_pp_labels(sample, k, rng):
+    """Picks k-means++ initial centers from sample with a Numpy Generator and labels each point with its nearest,
+    in the int32 column cv.kmeans takes with KMEANS_USE_INITIAL_LABELS.
+    """
+    chosen = [rng.integers(len(sample))]
+    nearest = ((sample - sample[chosen[0]]) ** 2).sum(axis=1).astype(np.float64)
+    for _ in range(k - 1):
+        total = nearest.sum()
+        choice = rng.choice(len(sample), p=nearest / total) if total > 0 else rng.integers(len(sample))
+        chosen.append(choice)
+        nearest = np.minimum(nearest, ((sample - sample[choice]) ** 2).sum(axis=1))
+    distances = ((sample[:, None, :] - sample[chosen][None, :, :]) ** 2).sum(axis=2)
+    return distances.argmin(axis=1).astype(np.int32).reshape(-1, 1)
+
+
+def chords_from_palette(palette, notes, *, size=3, step=2):
+    """Builds a chord table with one chord per palette entry, darker entries get lower chords.
+    Each entry's brightness picks a root from notes and the chord stacks size notes step apart in notes from it,
+    e.g. triads in a scale with the default size and step.
+
+    Arguments:
+        palette: 2D number Numpy array, palette colors from palette_index
+        notes: list of ints, MIDI note numbers to build chords from, e.g. musx.scale(36, 36, 2, 2, 1, 2, 2, 2, 1)
+        size: int, number of notes per chord, defaults to 3
+        step: int, distance in notes between chord tones, defaults to 2
+
+    Returns:
+        2D int Numpy array, palette entries by chord tones, for palette_chords
+
+    Raises:
+        ValueError: notes cannot fit a chord of the requested size
+    """
+    span = (size - 1) * step
+    if len(notes) <= span:
+        raise ValueError ("Need more than {} notes to build chords of {} notes {} apart".format(span, size, step))
+
+    brightness = np.asarray(palette, dtype=np.float64).sum(axis=1)
+    low, high = brightness.min(), brightness.max()
+    roots = np.rint((brightness - low) / max(high - low, 1e-12) * (len(notes) - 1 - span)).astype(np.int64)
+    return np.asarray(notes)[roots[:, None] + np.arange(size) * step]
+
+
+def palette_chords(table, ids):
+    """Looks up the chords of palette IDs in one take.
+
+    Arguments:
+        table: 2D int Numpy array, chord per palette entry, e.g. from chords_from_palette
+        ids: int, list or Numpy array of palette IDs, e.g. what a walker over the index plane yielded
+
+    Returns:
+        Numpy array of chords, one row per ID
+    """
+    return np.take(table, np.ravel(ids), axis=0)
+
+
+def batch_image_features(imgs, *, workers=None, **kwargs):
+    """Computes image_features for a set of images on a thread pool, OpenCV and Numpy release the GIL while they work.
+
+    Arguments:
+        imgs: list of 2D or 3D number Numpy arrays, images to analyze
+        workers: int, number of threads, defaults to concurrent.futures' default
+        kwargs: arguments for image_features
+
+    Returns:
+        list of 3D uint8 Numpy arrays, feature planes of each image in order
+    """
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        return list(executor.map(lambda img: image_features(img, **kwargs), imgs))
+
+
+def _scale_plane(plane):
+    """Rescales a float plane to 0-255.
+    """
+    return cv.normalize(plane, None, 0, 255, cv.NORM_MINMAX, dtype=cv.CV_8U)
+
+
+def _fft_magnitude(gray):
+    """Log magnitude of the centered 2D DFT, which has the same shape as the image.
+    """
+    spectrum = cv.dft(gray, flags=cv.DFT_COMPLEX_OUTPUT)
+    magnitude = cv.magnitude(spectrum[..., 0], spectrum[..., 1])
+    return _scale_plane(np.log1p(np.fft.fftshift(magnitude)))
+
+
+def _orientation(gray, bins, window):
+    """Per pixel dominant orientation, the fullest bin of a gradient magnitude weighted orientation histogram
+    gathered over the window around it.
+    """
+    gx = cv.Sobel(gray, cv.CV_32F, 1, 0)
+    gy = cv.Sobel(gray, cv.CV_32F, 0, 1)
+    magnitude, angle = cv.cartToPolar(gx, gy)
+    # Orientation is unsigned, a gradient and its opposite are the same edge
+    binned = (np.mod(angle, np.pi) * (bins / np.pi)).astype(np.int64) % bins
+    votes = np.empty((bins, *gray.shape), dtype=np.float32)
+    for index in range(bins):
+        votes[index] = cv.boxFilter(np.where(binned == index, magnitude, 0).astype(np.float32), -1, (window, window))
+    return (votes.argmax(axis=0) * (255 / (bins - 1))).astype(np.uint8)
+
+
+def _edge_energy(gray, window):
+    """Squared gradient magnitude averaged over the window.
+    """
+    gx = cv.Sobel(gray, cv.CV_32F, 1, 0)
+    gy = cv.Sobel(gray, cv.CV_32F, 0, 1)
+    return _scale_plane(cv.boxFilter(gx * gx + gy * gy, -1, (window, window)))
+
+
+
 # ------------- #
 # 2D Generators #
 # ------------- #
 
+def _record_point(row, col):
+    """Records a visited location in points_cache and hands it to any subscribers without blocking.
+    """
+    points_cache.append((row, col))
+    if _point_subscribers:
+        for subscriber in _point_subscribers:
+            try:
+                subscriber.put_nowait((row, col))
+            except queue_module.Full: # Subscriber is behind, drop rather than slow the generator down
+                pass
+
+
+def _pixel_getter(np_items):
+    """Picks how the 2D generators read a location, once, from the array's layout.
+    Multichannel locations are yielded as a list of their channels and single channel (grayscale) locations
+    as a one item list, without having to try the multichannel read first and catch its TypeError.
+    """
+    if np_items.ndim == 2:
+        return lambda row, col: [np_items[row, col]]
+    return lambda row, col: list(np_items[row, col])
+
+
 def traversal_2d(items, stop=None, *, start_row=0, start_col=0, movement=[(0, 1), (1, 0)]):
     """Traverses a two dimensional list / numpy array according to movement rules.
     If the first movement rule walks off the array, the second movement rule is used
     and the indices wrap using the % operator.
+    The steps are computed in blocks by a compiled kernel when Numba is installed.
 
     Arguments:
         items: 2D list / 2D numpy array, items to walk through
@@ -327,47 +789,37 @@ def traversal_2d(items, stop=None, *, start_row=0, start_col=0, movement=[(0, 1)
         ValueError: items is one dimensional
     """
 
-    global points_cache
     np_items = np.array(items)
 
     if len(np_items.shape) < 2:
         raise ValueError ("Provided items array cannot be one dimensional")
 
+    pixel = _pixel_getter(np_items)
+
     if stop == None:
         stop = sys.maxsize
 
     row = start_row
     col = start_col
+    taken = 0
 
-    points_cache.append((row, col))
-    try:
-        yield list(np_items[row, col]), (row, col)
-    except TypeError: # Error catching for grayscale, which is only 2D
-        yield list([np_items[row, col]]), (row, col)
+    # Locations are stepped a block at a time by the _traversal_walk kernel
+    while taken < stop:
+        count = min(walk_block_size, stop - taken)
+        located = _traversal_walk(count, taken == 0, row, col, np_items.shape[0], np_items.shape[1], movement[0][0], movement[0][1], movement[1][0], movement[1][1])
+        row, col = located[-1].tolist()
+        taken += count
 
-    for _ in range(stop - 1):
-        row += movement[0][0]
-        col += movement[0][1]
-
-        # Use second movement rule if off bounds
-        if row >= np_items.shape[0] or row < 0 or col >= np_items.shape[1] or col < 0:
-            row += movement[1][0]
-            col += movement[1][1]
-        
-        row %= np_items.shape[0]
-        col %= np_items.shape[1]
-
-        points_cache.append((row, col))
-        
-        try:
-            yield list(np_items[row, col]), (row, col)
-        except TypeError: # Error catching for grayscale, which is only 2D
-            yield list([np_items[row, col]]), (row, col)
+        for row_at, col_at in located.tolist():
+            _record_point(row_at, col_at)
+            yield pixel(row_at, col_at), (row_at, col_at)
 
 
 def drunk_2d(items, stop=None, *, start_row=0, start_col=0, width=(1, 1), movement_2d=True, mode="wrap"):
     """Drunkenly walks along a two dimensional list / numpy array.
     Based off of musx.generators.drunk.
+    Each move is drawn from musx's random stream as it is taken, so the walk steps in plain Python and is not
+    compiled with Numba, use stream_2d for a compiled drunk walk.
 
     Arguments:
         items: 2D list / 2D numpy array, items to walk through
@@ -384,23 +836,21 @@ def drunk_2d(items, stop=None, *, start_row=0, start_col=0, width=(1, 1), moveme
     Raises:
         ValueError: items is one dimensional
     """
-    global points_cache
     np_items = np.array(items)
 
     if len(np_items.shape) < 2:
         raise ValueError ("Provided items array cannot be one dimensional")
 
+    pixel = _pixel_getter(np_items)
+
     if stop == None:
         stop = sys.maxsize
 
     row = start_row
     col = start_col
 
-    points_cache.append((row, col))
-    try:
-        yield list(np_items[row, col]), (row, col)
-    except TypeError: # Error catching for grayscale, which is only 2D
-        yield list([np_items[row, col]]), (row, col)
+    _record_point(row, col)
+    yield pixel(row, col), (row, col)
 
     row_deviation = musx.choose([x for x in range(-1 * width[0], width[0] + 1)])
     col_deviation = musx.choose([x for x in range(-1 * width[1], width[1] + 1)])
@@ -418,11 +868,8 @@ def drunk_2d(items, stop=None, *, start_row=0, start_col=0, width=(1, 1), moveme
         row = musx.fit(row, 0, items.shape[0] - 1, mode=mode)
         col = musx.fit(col, 0, items.shape[1] - 1, mode=mode)
 
-        points_cache.append((row, col))
-        try:
-            yield list(np_items[row, col]), (row, col)
-        except TypeError: # Error catching for grayscale, which is only 2D
-            yield list([np_items[row, col]]), (row, col)
+        _record_point(row, col)
+        yield pixel(row, col), (row, col)
 
 
 def random_2d(items, stop=None):
@@ -438,12 +885,13 @@ def random_2d(items, stop=None):
     Raises:
         ValueError: items is one dimensional
     """
-    global points_cache
     np_items = np.array(items)
 
     if len(np_items.shape) < 2:
         raise ValueError ("Provided items array cannot be one dimensional")
 
+    pixel = _pixel_getter(np_items)
+
     if stop == None:
         stop = sys.maxsize
 
@@ -452,12 +900,9 @@ def random_2d(items, stop=None):
         row = round(musx.uniran() * (items.shape[0] - 1))
         col = round(musx.uniran() * (items.shape[1] - 1))
 
-        points_cache.append((row, col))
+        _record_point(row, col)
 
-        try:
-            yield list(np_items[row, col]), (row, col)
-        except TypeError: # Error catching for grayscale, which is only 2D
-            yield list([np_items[row, col]]), (row, col)
+        yield pixel(row, col), (row, col)
 
 
 def distribution_2d(items, stop=None, *, row_distribution=musx.gauss, row_dist_low=-4, row_dist_high=4, col_distribution=musx.gauss, col_dist_low=-4, col_dist_high=4):
@@ -479,12 +924,13 @@ def distribution_2d(items, stop=None, *, row_distribution=musx.gauss, row_dist_l
     Raises:
         ValueError: items is one dimensional
     """
-    global points_cache
     np_items = np.array(items)
 
     if len(np_items.shape) < 2:
         raise ValueError ("Provided items array cannot be one dimensional")
 
+    pixel = _pixel_getter(np_items)
+
     if stop == None:
         stop = sys.maxsize
 
@@ -496,11 +942,8 @@ def distribution_2d(items, stop=None, *, row_distribution=musx.gauss, row_dist_l
         row = round(musx.rescale(row_raw, row_dist_low, row_dist_high, 0, items.shape[0] - 1))
         col = round(musx.rescale(col_raw, col_dist_low, col_dist_high, 0, items.shape[1] - 1))
 
-        points_cache.append((row, col))
-        try:
-            yield list(np_items[row, col]), (row, col)
-        except TypeError: # Error catching for grayscale, which is only 2D
-            yield list([np_items[row, col]]), (row, col)
+        _record_point(row, col)
+        yield pixel(row, col), (row, col)
 
 
 def line_2d(items, stop=None, *, start_row, start_col, end_row, end_col, num_steps=10):
@@ -521,23 +964,21 @@ def line_2d(items, stop=None, *, start_row, start_col, end_row, end_col, num_ste
     Raises:
         ValueError: items is one dimensional
     """
-    global points_cache
     np_items = np.array(items)
 
     if len(np_items.shape) < 2:
         raise ValueError ("Provided items array cannot be one dimensional")
 
+    pixel = _pixel_getter(np_items)
+
     if stop == None:
         stop = sys.maxsize
 
     exact_row = start_row
     exact_col = start_col
 
-    points_cache.append((exact_row, exact_col))
-    try:
-        yield list(np_items[exact_row, exact_col]), (exact_row, exact_col)
-    except TypeError: # Error catching for grayscale, which is only 2D
-        yield list([np_items[exact_row, exact_col]]), (exact_row, exact_col)
+    _record_point(exact_row, exact_col)
+    yield pixel(exact_row, exact_col), (exact_row, exact_col)
 
     row_step = (end_row - start_row) / num_steps
     col_step = (end_col - start_col) / num_steps
@@ -549,18 +990,794 @@ def line_2d(items, stop=None, *, start_row, start_col, end_row, end_col, num_ste
         row = round(exact_row)
         col = round(exact_col)
 
-        points_cache.append((row, col))
-        try:
-            yield list(np_items[row, col]), (row, col)
-        except TypeError: # Error catching for grayscale, which is only 2D
-            yield list([np_items[row, col]]), (row, col)
+        _record_point(row, col)
+        yield pixel(row, col), (row, col)
 
         if row == end_row and col == end_col:
             break
 
 
+def flow_2d(items, stop=None, *, follow="uphill", start_row=0, start_col=0, step_size=1.0, wander=0.0, mode="reflect", field=None, seed=None):
+    """Walks along a flow field over a two dimensional list / numpy array, see flow_field.
+    The field is computed once and each step only looks up the direction at the current location.
+    Edge directions have no sign, so edge walks keep heading the way they came. Where the field has no direction
+    (flat areas) a random one is taken so the walker never stalls.
+
+    Arguments:
+        items: 2D list / 2D numpy array, items to walk through
+        stop: int, number of items to yield, defaults to infinite*
+        follow: string, one of "uphill", "downhill" or "edge", with a given field "edge" only keeps the heading, defaults to uphill
+        start_row: int, starting location in the first dimension, defaults to 0
+        start_col: int, starting location in the second dimension, defaults to 0
+        step_size: number, distance moved per step in array cells, defaults to 1
+        wander: number, standard deviation in radians of random turns added to each step, defaults to 0
+        mode: string, how to handle out of bounds, "wrap", "reflect" or "limit", defaults to reflecting
+        field: 3D number Numpy array, field to follow (e.g. from flow_field of another image), defaults to flow_field of items
+        seed: int, seed of the walk's random numbers, defaults to one drawn from musx's random stream
+
+    Yields:
+        Information at the given location, coordinates
+
+    Raises:
+        ValueError: items is one dimensional, unknown mode or field does not match items
+    """
+    np_items = np.array(items)
+
+    if len(np_items.shape) < 2:
+        raise ValueError ("Provided items array cannot be one dimensional")
+
+    if mode not in ["wrap", "reflect", "limit"]:
+        raise ValueError ("Specified mode '{}' is not one of wrap, reflect or limit".format(mode))
+
+    if field is None:
+        field = flow_field(np.asarray(items), follow=follow)
+    elif field.shape[:2] != np_items.shape[:2]:
+        raise ValueError ("Flow field does not have the same shape as items")
+
+    pixel = _pixel_getter(np_items)
+
+    if stop == None:
+        stop = sys.maxsize
+
+    rng = np.random.default_rng(int(musx.uniran() * 2**53) if seed is None else seed)
+    last_row, last_col = np_items.shape[0] - 1, np_items.shape[1] - 1
+    exact_row, exact_col = float(start_row), float(start_col)
+    heading_row, heading_col = 0.0, 0.0
+
+    for _ in range(stop):
+        row = int(exact_row + 0.5)
+        col = int(exact_col + 0.5)
+
+        _record_point(row, col)
+        yield pixel(row, col), (row, col)
+
+        step_row = field.item(row, col, 0)
+        step_col = field.item(row, col, 1)
+        if step_row == 0 and step_col == 0:
+            angle = rng.uniform(0, 2 * math.pi)
+            step_row, step_col = math.sin(angle), math.cos(angle)
+        elif follow == "edge" and step_row * heading_row + step_col * heading_col < 0:
+            step_row, step_col = -step_row, -step_col
+        if wander > 0:
+            angle = math.atan2(step_row, step_col) + rng.normal(0, wander)
+            step_row, step_col = math.sin(angle), math.cos(angle)
+        heading_row, heading_col = step_row, step_col
+
+        exact_row = _fit_position(exact_row + step_size * step_row, last_row, mode)
+        exact_col = _fit_position(exact_col + step_size * step_col, last_col, mode)
+
+
+def flow_walkers(items, walkers, stop=None, *, follow="uphill", step_size=1.0, wander=0.0, mode="reflect", field=None, seed=None):
+    """Steps many flow_2d walkers at once, every walker's step is one vectorized lookup into the field.
+    Yields arrays like stream_2d, and like it does not record into points_cache.
+
+    Arguments:
+        items: 2D list / 2D numpy array, items to walk through
+        walkers: int or list of (row, col) pairs, number of walkers to start at random locations, or their starting locations
+        stop: int, number of steps to take, defaults to infinite*
+        follow: string, one of "uphill", "downhill" or "edge", with a given field "edge" only keeps the heading, defaults to uphill
+        step_size: number, distance moved per step in array cells, defaults to 1
+        wander: number, standard deviation in radians of random turns added to each step, defaults to 0
+        mode: string, how to handle out of bounds, "wrap", "reflect" or "limit", defaults to reflecting
+        field: 3D number Numpy array, field to follow, defaults to flow_field of items
+        seed: int, seed of the walk's random numbers, defaults to one drawn from musx's random stream
+
+    Yields:
+        per step, information at every walker's location, their rows and their columns as Numpy arrays
+
+    Raises:
+        ValueError: items is one dimensional, unknown mode or field does not match items
+    """
+    np_items = np.asarray(items)
+
+    if len(np_items.shape) < 2:
+        raise ValueError ("Provided items array cannot be one dimensional")
+
+    if mode not in ["wrap", "reflect", "limit"]:
+        raise ValueError ("Specified mode '{}' is not one of wrap, reflect or limit".format(mode))
+
+    if field is None:
+        field = flow_field(np_items, follow=follow)
+    elif field.shape[:2] != np_items.shape[:2]:
+        raise ValueError ("Flow field does not have the same shape as items")
+
+    if stop == None:
+        stop = sys.maxsize
+
+    rng = np.random.default_rng(int(musx.uniran() * 2**53) if seed is None else seed)
+    last = np.array(np_items.shape[:2], dtype=np.float64) - 1
+    if isinstance(walkers, int):
+        exact = rng.random((walkers, 2)) * last
+    else:
+        exact = np.array(walkers, dtype=np.float64)
+    heading = np.zeros_like(exact)
+
+    for _ in range(stop):
+        located = (exact + 0.5).astype(np.int64)
+        rows = located[:, 0]
+        cols = located[:, 1]
+        yield np_items[rows, cols], rows, cols
+
+        steps = field[rows, cols].astype(np.float64)
+        if follow == "edge":
+            steps[(steps * heading).sum(axis=1) < 0] *= -1
+        flat = (steps == 0).all(axis=1)
+        angles = np.arctan2(steps[:, 0], steps[:, 1])
+        angles[flat] = rng.uniform(0, 2 * np.pi, flat.sum())
+        if wander > 0:
+            angles += rng.normal(0, wander, len(angles))
+        if wander > 0 or flat.any():
+            steps = np.column_stack((np.sin(angles), np.cos(angles)))
+        heading = steps
+
+        exact = _fit_positions(exact + step_size * steps, last, mode)
+
+
+def _fit_position(value, last, mode):
+    """Brings a fractional location back within 0-last, wrapping, reflecting or limiting like musx.fit.
+    """
+    if 0 <= value <= last:
+        return value
+    if mode == "limit" or last == 0:
+        return min(max(value, 0.0), float(last))
+    if mode == "wrap":
+        return value % (last + 1) if value % (last + 1) <= last else 0.0
+    folded = value % (2 * last)
+    return 2 * last - folded if folded > last else folded
+
+
+def _fit_positions(values, last, mode):
+    """_fit_position for an array of (row, col) locations.
+    """
+    if mode == "limit":
+        return np.clip(values, 0, last)
+    if mode == "wrap":
+        wrapped = values % (last + 1)
+        return np.where(wrapped <= last, wrapped, 0.0)
+    span = np.maximum(last, 1e-12)
+    folded = values % (2 * span)
+    return np.minimum(np.where(folded > span, 2 * span - folded, folded), last)
+
+
+def stream_2d(items, stop=None, *, walk="drunk", chunk_size=4096, arrays=False, start_row=0, start_col=0, width=(1, 1), movement_2d=True, mode="wrap", movement=[(0, 1), (1, 0)], seed=None):
+    """Streams a long or endless walk over a two dimensional list / numpy array in fixed size blocks.
+    Each block of locations is computed at once with Numpy and refilled when used up, and nothing is recorded in
+    points_cache, so memory stays flat however long the walk runs. Walks follow traversal_2d, random_2d and drunk_2d,
+    except that drunk walks step through all of a block's moves at once (wrap mode wraps modulo the array size) and
+    so are not step for step identical to drunk_2d. Step loops that can't be vectorized run as compiled kernels
+    when Numba is installed.
+
+    Arguments:
+        items: 2D list / 2D numpy array, items to walk through
+        stop: int, number of items to yield, defaults to infinite
+        walk: string, one of "traversal", "random" or "drunk", defaults to drunk
+        chunk_size: int, number of locations computed per block, defaults to 4096
+        arrays: boolean, whether to yield each block as arrays instead of item by item, defaults to False
+        start_row: int, starting location in the first dimension (traversal and drunk), defaults to 0
+        start_col: int, starting location in the second dimension (traversal and drunk), defaults to 0
+        width: pair of ints, specifies range of dimensional movement (drunk), defaults to one in both dimensions
+        movement_2d: boolean, whether movement in both dimensions at same time is possible (drunk), defaults to True
+        mode: string, how to handle out of bounds, "wrap", "reflect" or "limit" (drunk), defaults to wrapping around
+        movement: list of two pairs, specifies dimensional movement (traversal), defaults to row-major
+        seed: int, seed of the walk's random numbers, defaults to one drawn from musx's random stream
+
+    Yields:
+        Information at the given location as a list of Python numbers, coordinates,
+        or with arrays, a block of information, rows and columns as Numpy arrays
+
+    Raises:
+        ValueError: items is one dimensional, unknown walk or mode, or chunk size is not positive
+    """
+    if walk not in valid_walks:
+        raise ValueError ("Specified walk '{}' is not in supported list of walks: {}".format(walk, ', '.join(valid_walks)))
+
+    if mode not in ["wrap", "reflect", "limit"]:
+        raise ValueError ("Specified mode '{}' is not one of wrap, reflect or limit".format(mode))
+
+    if chunk_size < 1:
+        raise ValueError ("Chunk size must be 1 or greater")
+
+    np_items = np.asarray(items)
+
+    if len(np_items.shape) < 2:
+        raise ValueError ("Provided items array cannot be one dimensional")
+
+    if stop == None:
+        stop = sys.maxsize
+
+    shape = np.array(np_items.shape[:2])
+    rng = np.random.default_rng(int(musx.uniran() * 2**53) if seed is None else seed)
+    position = np.array([start_row, start_col], dtype=np.int64)
+    taken = 0
+
+    while taken < stop:
+        count = min(chunk_size, stop - taken)
+
+        if walk == "random":
+            located = np.column_stack((rng.integers(0, shape[0], count), rng.integers(0, shape[1], count)))
+        elif walk == "traversal":
+            located, position = _traversal_block(position, count, taken == 0, shape, movement)
+        else:
+            located, position = _drunk_block(position, count, taken == 0, shape, rng, width, movement_2d, mode)
+
+        rows = located[:, 0]
+        cols = located[:, 1]
+        values = np_items[rows, cols]
+        taken += count
+
+        if arrays:
+            yield values, rows, cols
+        elif values.ndim == 1: # Grayscale, only 2D
+            for value, row, col in zip(values.tolist(), rows.tolist(), cols.tolist()):
+                yield [value], (row, col)
+        else:
+            for value, row, col in zip(values.tolist(), rows.tolist(), cols.tolist()):
+                yield value, (row, col)
+
+
+def _traversal_block(position, count, first, shape, movement):
+    """Computes the next count locations of a traversal_2d walk, vectorized for row-major and column-major movement
+    and stepped by the _traversal_walk kernel for any other.
+    The walk starts on position when first, otherwise it continues from it.
+
+    Returns:
+        count x 2 Numpy array of locations and the last location
+    """
+    offsets = np.arange(count) if first else np.arange(1, count + 1)
+    if [tuple(move) for move in movement] == [(0, 1), (1, 0)]:
+        linear = position[0] * shape[1] + position[1] + offsets
+        located = np.column_stack(((linear // shape[1]) % shape[0], linear % shape[1]))
+    elif [tuple(move) for move in movement] == [(1, 0), (0, 1)]:
+        linear = position[1] * shape[0] + position[0] + offsets
+        located = np.column_stack((linear % shape[0], (linear // shape[0]) % shape[1]))
+    else:
+        located = _traversal_walk(count, first, position[0], position[1], shape[0], shape[1], movement[0][0], movement[0][1], movement[1][0], movement[1][1])
+    return located, located[-1].copy()
+
+
+def _drunk_block(position, count, first, shape, rng, width, movement_2d, mode):
+    """Computes the next count locations of a drunk walk.
+    Wrap and reflect fold the unbounded walk into range, so position is kept unbounded for them; limit is clamped
+    step by step by the _clamp_walk kernel.
+
+    Returns:
+        count x 2 Numpy array of locations and the position to continue from
+    """
+    steps = np.column_stack((rng.integers(-width[0], width[0] + 1, count), rng.integers(-width[1], width[1] + 1, count)))
+    if not movement_2d:
+        row_moves = rng.random(count) < 0.5
+        steps[row_moves, 1] = 0
+        steps[~row_moves, 0] = 0
+    if first:
+        steps[0] = 0
+
+    if mode == "limit":
+        located = _clamp_walk(steps, position[0], position[1], shape[0], shape[1])
+        return located, located[-1].copy()
+
+    walked = position + np.cumsum(steps, axis=0)
+    if mode == "wrap":
+        located = walked % shape
+    else:
+        span = shape - 1
+        folded = walked % np.maximum(2 * span, 1)
+        located = np.where(folded > span, 2 * span - folded, folded)
+    return located, walked[-1].copy()
+
+
 def clear_points_cache():
     """Clears the global points cache variable.
     """
     global points_cache
-    points_cache = []
\ No newline at end of file
+    points_cache = []
+
+
+# ------------ #
+# Walk Kernels #
+# ------------ #
+
+def _kernel(function):
+    """Compiles a walk step loop with Numba when it is installed, otherwise leaves it as plain Python.
+    The kernels step traversal_2d and stream_2d; drunk_2d and the other generators draw from musx's random stream
+    step by step and stay in Python.
+    Kernels only take and return Numpy arrays and numbers and draw no random numbers themselves,
+    so compiled and plain versions give identical results.
+    """
+    if numba is None:
+        return function
+    return numba.njit(cache=True, nogil=True)(function)
+
+
+@_kernel
+def _clamp_walk(steps, row, col, n_rows, n_cols):
+    """Walks steps from row, col, clamping each step into range like musx.fit's limit mode.
+    """
+    located = np.empty((steps.shape[0], 2), dtype=np.int64)
+    for index in range(steps.shape[0]):
+        row = min(max(row + steps[index, 0], 0), n_rows - 1)
+        col = min(max(col + steps[index, 1], 0), n_cols - 1)
+        located[index, 0] = row
+        located[index, 1] = col
+    return located
+
+
+@_kernel
+def _traversal_walk(count, first, row, col, n_rows, n_cols, row_move, col_move, row_fallback, col_fallback):
+    """Walks count steps of a traversal_2d movement rule from row, col, starting on it when first.
+    """
+    located = np.empty((count, 2), dtype=np.int64)
+    for index in range(count):
+        if index > 0 or not first:
+            row += row_move
+            col += col_move
+            # Use second movement rule if off bounds
+            if row >= n_rows or row < 0 or col >= n_cols or col < 0:
+                row += row_fallback
+                col += col_fallback
+            row %= n_rows
+            col %= n_cols
+        located[index, 0] = row
+        located[index, 1] = col
+    return located
+
+
+
+# ------------------ #
+# Path Visualization #
+# ------------------ #
+
+def subscribe_points(maxsize=4096):
+    """Subscribes to the locations the 2D generators visit, as they visit them.
+    Locations are put on the queue without blocking, when it is full they are dropped, so a slow reader never
+    slows the generators down.
+
+    Arguments:
+        maxsize: int, number of locations the queue holds before dropping, defaults to 4096
+
+    Returns:
+        queue.Queue object of (row, col) pairs
+    """
+    subscriber = queue_module.Queue(maxsize)
+    _point_subscribers.append(subscriber)
+    return subscriber
+
+
+def unsubscribe_points(subscriber):
+    """Stops putting visited locations on a queue from subscribe_points.
+
+    Arguments:
+        subscriber: queue.Queue object, queue to stop feeding
+    """
+    if subscriber in _point_subscribers:
+        _point_subscribers.remove(subscriber)
+
+
+class PathVisualizer:
+    """Draws the paths of the 2D generators over an image live, while they run.
+    The image is drawn once as a preview (see display_preview) and visited locations are painted into a transparent
+    overlay of the same size. Each update only drains the newly visited locations, paints them and blits the overlay
+    over the saved background, the image itself is not redrawn.
+    Updates have to happen on the thread running matplotlib, either by calling update or by starting the timer
+    with animate, while the generators can run on any thread.
+
+    Arguments:
+        img: 2D or 3D number Numpy array, image the generators walk over, assumes grayscale or RGB format
+        color: tuple of three ints (0-255), RGB color to draw paths in, defaults to red
+        enlarge: int, radius in preview pixels drawn around each location, defaults to 1
+        maxsize: int, number of locations buffered between updates before dropping, defaults to 4096
+
+    Example:
+        vis = musx_images.PathVisualizer(img)
+        vis.animate(50)
+        threading.Thread(target=queue.compose, args=([[0, wanderer(queue, img)]],)).start()
+    
+    Raises:
+        ValueError: image has too few or too many dimensions
+    """
+
+    def __init__(self, img, *, color=(255, 0, 0), enlarge=1, maxsize=4096):
+        if len(img.shape) != 2 and len(img.shape) != 3:
+            raise ValueError ("Image is not two or three dimensional")
+
+        self.shape = img.shape[:2]
+        self.color = np.array([*color, 255], dtype=np.uint8)
+        self.enlarge = enlarge
+        self.points = subscribe_points(maxsize)
+        self.fig, axes = plt.subplots(1, 1, figsize=(10, 10))
+        self.axes = axes
+
+        extent = axes.get_window_extent()
+        preview = _preview_level(img, max(1, round(extent.width)), max(1, round(extent.height)))
+        if len(preview.shape) == 2:
+            axes.imshow(preview, cmap='gray')
+        else:
+            axes.imshow(preview)
+        self.overlay = np.zeros((*preview.shape[:2], 4), dtype=np.uint8)
+        self._overlay_image = axes.imshow(self.overlay, animated=True)
+        self._scale = (preview.shape[0] / self.shape[0], preview.shape[1] / self.shape[1])
+        self._background = None
+        self._timer = None
+        self.fig.canvas.mpl_connect("draw_event", self._on_draw)
+
+    def _on_draw(self, event):
+        canvas = self.fig.canvas
+        self._background = canvas.copy_from_bbox(self.axes.bbox)
+        self.axes.draw_artist(self._overlay_image)
+
+    def _drain(self):
+        """Takes every location waiting on the queue, at most one queue's worth so a busy generator can't stall an update.
+        """
+        points = []
+        for _ in range(self.points.maxsize or self.points.qsize()):
+            try:
+                points.append(self.points.get_nowait())
+            except queue_module.Empty:
+                break
+        return points
+
+    def update(self):
+        """Paints newly visited locations into the overlay and blits it.
+
+        Returns:
+            int, number of locations painted
+        """
+        points = self._drain()
+        if not points:
+            return 0
+
+        located = np.array(points)
+        rows = (located[:, 0] * self._scale[0]).astype(np.int64)
+        cols = (located[:, 1] * self._scale[1]).astype(np.int64)
+        for row_offset in range(-self.enlarge, self.enlarge + 1):
+            for col_offset in range(-self.enlarge, self.enlarge + 1):
+                self.overlay[np.clip(rows + row_offset, 0, self.overlay.shape[0] - 1), np.clip(cols + col_offset, 0, self.overlay.shape[1] - 1)] = self.color
+        self._overlay_image.set_data(self.overlay)
+
+        canvas = self.fig.canvas
+        if self._background is None:
+            canvas.draw()
+        else:
+            canvas.restore_region(self._background)
+            self.axes.draw_artist(self._overlay_image)
+            canvas.blit(self.axes.bbox)
+        canvas.flush_events()
+        return len(points)
+
+    def animate(self, interval=50):
+        """Calls update on a timer of the figure's GUI event loop.
+
+        Arguments:
+            interval: int, milliseconds between updates, defaults to 50
+        """
+        self._timer = self.fig.canvas.new_timer(interval=interval)
+        self._timer.add_callback(self.update)
+        self._timer.start()
+
+    def clear(self):
+        """Erases the drawn paths.
+        """
+        self.overlay[...] = 0
+        self._overlay_image.set_data(self.overlay)
+        self.fig.canvas.draw_idle()
+
+    def close(self):
+        """Stops the timer and unsubscribes, the figure is left as drawn.
+        """
+        if self._timer is not None:
+            self._timer.stop()
+            self._timer = None
+        unsubscribe_points(self.points)
+
+
+
+# ------------------ #
+# Shared Image Store #
+# ------------------ #
+
+class ImageHandle(collections.namedtuple("ImageHandle", ["name", "shape", "dtype", "path"])):
+    """Picklable reference to an image held by an ImageStore, send this to worker processes instead of the image.
+
+    Attributes:
+        name: string, shared memory block name, or file name for memory-mapped images
+        shape: tuple of ints, shape of the image
+        dtype: string, Numpy dtype string of the image
+        path: string, filepath of the memory-mapped file, None for shared memory
+    """
+
+    __slots__ = ()
+
+    def attach(self):
+        """Maps the image into this process without copying it.
+        Attaching the same handle again in a process returns the same view.
+
+        Returns:
+            2D or 3D number Numpy array, read-only view of the image
+        """
+        if self.name not in _attached_images:
+            if self.path is None:
+                block = shared_memory.SharedMemory(name=self.name)
+                img = np.ndarray(self.shape, dtype=self.dtype, buffer=block.buf)
+            else:
+                block = None
+                img = np.memmap(self.path, dtype=self.dtype, mode="r", shape=self.shape)
+            img.flags.writeable = False
+            _attached_images[self.name] = (block, img)
+        return _attached_images[self.name][1]
+
+    def detach(self):
+        """Unmaps the image from this process, views returned by attach must not be used afterwards.
+        """
+        block, _ = _attached_images.pop(self.name, (None, None))
+        if block is not None:
+            block.close()
+
+
+class ImageStore:
+    """Holds images in shared memory, or in memory-mapped files, so that any number of worker processes can read
+    one copy of the pixels. Workers are sent an ImageHandle and attach to it for a zero-copy read-only view.
+    Each image is reference counted, it is freed once every reference taken with put or acquire has been released.
+
+    Arguments:
+        directory: string, directory to keep memory-mapped files in, defaults to using shared memory instead
+
+    Example:
+        with musx_images.ImageStore() as store:
+            handle = store.put(musx_images.load_image("bird.png"))
+            pool.map(sonify, [handle] * 8)  # each worker calls handle.attach()
+            store.release(handle)
+    """
+
+    def __init__(self, *, directory=None):
+        self.directory = directory
+        self._count = 0
+        self._images = {}
+
+    def __len__(self):
+        return len(self._images)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def put(self, img):
+        """Copies an image into the store with one reference taken.
+
+        Arguments:
+            img: 2D or 3D number Numpy array, image to store
+
+        Returns:
+            ImageHandle object, handle to pass to workers
+        """
+        img = np.ascontiguousarray(img)
+        if self.directory is None:
+            block = shared_memory.SharedMemory(create=True, size=max(1, img.nbytes))
+            np.ndarray(img.shape, dtype=img.dtype, buffer=block.buf)[...] = img
+            handle = ImageHandle(block.name, img.shape, img.dtype.str, None)
+        else:
+            block = None
+            name = "musx_image_{}_{}".format(os.getpid(), self._count)
+            path = os.path.join(self.directory, name + ".dat")
+            mapped = np.memmap(path, dtype=img.dtype, mode="w+", shape=img.shape)
+            mapped[...] = img
+            mapped.flush()
+            del mapped
+            handle = ImageHandle(name, img.shape, img.dtype.str, path)
+        self._count += 1
+        self._images[handle.name] = [1, block, handle.path]
+        return handle
+
+    def acquire(self, handle):
+        """Takes another reference to a stored image.
+
+        Arguments:
+            handle: ImageHandle object, image to reference
+
+        Returns:
+            the ImageHandle, for chaining
+
+        Raises:
+            ValueError: image is not in the store
+        """
+        if handle.name not in self._images:
+            raise ValueError ("Image '{}' is not in the store".format(handle.name))
+        self._images[handle.name][0] += 1
+        return handle
+
+    def release(self, handle):
+        """Drops a reference to a stored image, freeing it when it was the last one.
+
+        Arguments:
+            handle: ImageHandle object, image to release
+
+        Raises:
+            ValueError: image is not in the store
+        """
+        if handle.name not in self._images:
+            raise ValueError ("Image '{}' is not in the store".format(handle.name))
+        entry = self._images[handle.name]
+        entry[0] -= 1
+        if entry[0] == 0:
+            del self._images[handle.name]
+            self._free(handle.name, entry[1], entry[2])
+
+    def _free(self, name, block, path):
+        attached_block, _ = _attached_images.pop(name, (None, None))
+        if attached_block is not None:
+            attached_block.close()
+        if block is not None:
+            block.close()
+            block.unlink()
+        elif path is not None and os.path.exists(path):
+            os.remove(path)
+
+    def close(self):
+        """Frees every image left in the store, whatever its reference count.
+        """
+        for name, (_, block, path) in self._images.items():
+            self._free(name, block, path)
+        self._images.clear()
+
+
+
+# --------------- #
+# Batch Rendering #
+# --------------- #
+
+def _limit_memory(memory_limit):
+    """Pool initializer that caps a worker's data segment (heap and private mappings), where the platform allows it.
+    RLIMIT_DATA is used rather than RLIMIT_AS, which also counts the address space reserved by library imports and
+    thread stacks and so fails for reasons unrelated to rendering. Shared image mappings are not counted either.
+    """
+    if memory_limit is not None and resource is not None:
+        resource.setrlimit(resource.RLIMIT_DATA, (memory_limit, memory_limit))
+
+
+def _prepare_image(task):
+    """Loads and preprocesses one image in a worker.
+    """
+    image_path, color_space, preprocess = task
+    img = load_image(image_path, color_space=color_space)
+    if preprocess is not None:
+        img = preprocess(img)
+    return image_path, img
+
+
+def _render_task(task):
+    """Renders one composition of one stored image to a MIDI file in a worker.
+    """
+    handle, composition, midi_path, ins = task
+    start = time.perf_counter()
+    try:
+        clear_points_cache()
+        meta = musx.MidiSeq.metaseq(ins=ins)
+        seq = musx.MidiSeq()
+        queue = musx.Scheduler(out=seq)
+        queue.compose(composition(queue, handle.attach()))
+        musx.MidiFile(midi_path, [meta, seq]).write()
+    finally:
+        clear_points_cache()
+        handle.detach()
+    return handle, midi_path, len(seq), time.perf_counter() - start
+
+
+def render_batch(image_paths, compositions, output_dir, *, ins=None, color_space="RGB", preprocess=None, workers=None, max_tasks_per_child=16, memory_limit=None, store_directory=None, report=True):
+    """Renders compositions over a batch of images to MIDI files, spread across a pool of worker processes.
+    Images are loaded and preprocessed in the workers and then put in an ImageStore once, every composition
+    of an image reads that same copy. At most two images per worker are loaded or rendering at a time, and each is
+    freed once its last composition is written. Workers are replaced after max_tasks_per_child renders so that memory they hold onto is returned.
+    Compositions and preprocess are sent to the workers, so they have to be module level functions
+    (or functools.partial of them), not lambdas.
+
+    Arguments:
+        image_paths: list of strings, filepaths of the images to render
+        compositions: dictionary of name to function, each takes the scheduler and an image and returns what to pass
+            to queue.compose, e.g. {"triads": image_triads} writes <image name>_triads.mid
+        output_dir: string, directory to write the MIDI files to
+        ins: dictionary of channel to General MIDI instrument, written to a musx metaseq as track 0 like in the
+            example notebooks, e.g. {0: musx.midi.gm.Kalimba}, defaults to no instruments
+        color_space: string, color space to load images in, defaults to RGB
+        preprocess: function, takes an image and returns the image to render, e.g. functools.partial(blur_image, intensity=4)
+        workers: int, number of worker processes, defaults to the number of CPUs
+        max_tasks_per_child: int, number of tasks a worker handles before it is replaced, defaults to 16
+        memory_limit: int, maximum heap and private memory of each worker in bytes (POSIX only, not enforced on
+            every platform), defaults to no limit. Most memory is held by the images in the window, not the workers
+        store_directory: string, directory to keep images in as memory-mapped files, defaults to shared memory
+        report: boolean, whether to print progress and throughput, defaults to True
+
+    Returns:
+        dictionary of files written, events written, seconds taken and files per second
+
+    Raises:
+        ValueError: specified color space is not supported or no compositions were given
+    """
+    if color_space not in valid_color_spaces:
+        raise ValueError ("Specified color space '{}' is not in supported list of color spaces: {}".format(color_space, ', '.join(valid_color_spaces)))
+
+    if len(compositions) == 0:
+        raise ValueError ("No compositions given to render")
+
+    os.makedirs(output_dir, exist_ok=True)
+    start = time.perf_counter()
+    events = 0
+
+    if os.name == "posix":
+        # Workers have to share this process' resource tracker, one of their own would unlink the images when they exit
+        resource_tracker.ensure_running()
+
+    # Only a window of images is loaded or rendering at once, the next image is prepared when one finishes
+    window = 2 * (workers or os.cpu_count() or 1)
+    pending = iter(image_paths)
+    finished = queue_module.Queue()
+    files = len(image_paths) * len(compositions)
+    preparing = 0
+    rendering = {}
+    done = 0
+
+    with ImageStore(directory=store_directory) as store, multiprocessing.Pool(workers, initializer=_limit_memory, initargs=(memory_limit,), maxtasksperchild=max_tasks_per_child) as pool:
+        def prepare_next():
+            image_path = next(pending, None)
+            if image_path is None:
+                return 0
+            pool.apply_async(_prepare_image, ((image_path, color_space, preprocess),), callback=lambda result: finished.put((_prepare_image, result)), error_callback=lambda error: finished.put((None, error)))
+            return 1
+
+        for _ in range(window):
+            preparing += prepare_next()
+
+        while preparing or rendering:
+            task, result = finished.get()
+            if task is None:
+                raise result
+
+            if task is _prepare_image:
+                preparing -= 1
+                image_path, img = result
+                handle = store.put(img)
+                stem = os.path.splitext(os.path.basename(image_path))[0]
+                rendering[handle.name] = len(compositions)
+                for name, composition in compositions.items():
+                    pool.apply_async(_render_task, ((store.acquire(handle), composition, os.path.join(output_dir, "{}_{}.mid".format(stem, name)), ins or {}),), callback=lambda result: finished.put((_render_task, result)), error_callback=lambda error: finished.put((None, error)))
+                store.release(handle)
+                continue
+
+            # Each finished render drops its reference, so an image is freed as soon as its last composition is written
+            handle, midi_path, count, seconds = result
+            store.release(handle)
+            events += count
+            done += 1
+            rendering[handle.name] -= 1
+            if rendering[handle.name] == 0:
+                del rendering[handle.name]
+                preparing += prepare_next()
+            if report:
+                elapsed = time.perf_counter() - start
+                print("[{}/{}] {} ({} events, {:.2f}s) {:.2f} files/s".format(done, files, midi_path, count, seconds, done / elapsed), file=sys.stderr)
+
+    elapsed = time.perf_counter() - start
+    summary = {"files": files, "events": events, "seconds": elapsed, "files_per_second": files / elapsed if elapsed > 0 else 0}
+    if report:
+        print("Rendered {files} files ({events} events) in {seconds:.2f}s, {files_per_second:.2f} files/s".format(**summary), file=sys.stderr)
+    return summary
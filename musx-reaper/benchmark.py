@@ -0,0 +1,246 @@
+"""Timing benchmark for musx_reaper live playback.
+
+Renders a few dense compositions, plays them through musx_reaper.play into a loopback port and timestamps
+what arrives on the other end. Reports latency and jitter percentiles, throughput and dropped messages.
+
+The loopback is an rtmidi virtual output port read back by an rtmidi input port where the platform allows it
+(ALSA on Linux, CoreMIDI on macOS), otherwise an in-process port that timestamps messages as they are sent.
+Every message goes out as a short sysex tagged with its sequence number, so each arrival is matched to the send it
+came from even when messages are dropped.
+
+Usage:
+    python benchmark.py [--scenario all|cc|euclid|drunk] [--duration SECONDS] [--port auto|virtual|fake] [--json]
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import threading
+import time
+
+import musx
+import musx_reaper
+
+
+
+# ---------- #
+# Loopbacks  #
+# ---------- #
+
+class FakeLoopback:
+    """In-process stand-in for a MIDI port that timestamps every message as it is sent.
+    Arrivals are kept as (perf_counter stamp, message) pairs.
+    """
+
+    name = "fake"
+
+    def __init__(self):
+        self.arrivals = []
+
+    def send_message(self, message):
+        self.arrivals.append((time.perf_counter(), message))
+
+    def close_port(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class VirtualLoopback:
+    """rtmidi virtual output port read back through an rtmidi input port, timestamped in the input callback.
+    Arrivals are kept as (perf_counter stamp, message) pairs.
+
+    Raises:
+        RuntimeError: virtual ports are not available on this platform
+    """
+
+    name = "virtual"
+
+    def __init__(self, portname="musx_reaper benchmark"):
+        import rtmidi
+
+        self.arrivals = []
+        self._lock = threading.Lock()
+        self.out = rtmidi.MidiOut()
+        self.out.open_virtual_port(portname)
+        self.midiin = rtmidi.MidiIn()
+        self.midiin.ignore_types(sysex=False, timing=False, active_sense=False)
+        ports = self.midiin.get_ports()
+        matches = [i for i, name in enumerate(ports) if portname in name]
+        if not matches:
+            raise RuntimeError("Virtual port '{}' is not visible to MIDI input".format(portname))
+        self.midiin.open_port(matches[0])
+        self.midiin.set_callback(self._receive)
+
+    def _receive(self, event, data=None):
+        stamp = time.perf_counter()
+        with self._lock:
+            self.arrivals.append((stamp, event[0]))
+
+    def send_message(self, message):
+        self.out.send_message(message)
+
+    def close_port(self):
+        pass
+
+    def close(self):
+        self.midiin.close_port()
+        self.out.close_port()
+
+
+class SequencedPort:
+    """Sends each message through a loopback as a sysex carrying its sequence number instead of the message itself.
+    The number takes 21 bits, enough for two million messages per scenario.
+
+    Arguments:
+        loopback: FakeLoopback or VirtualLoopback object, port to send through
+    """
+
+    def __init__(self, loopback):
+        self.loopback = loopback
+        self.sent = 0
+
+    def send_message(self, message):
+        seq = self.sent
+        self.loopback.send_message([0xF0, 0x7D, (seq >> 14) & 0x7F, (seq >> 7) & 0x7F, seq & 0x7F, 0xF7])
+        self.sent += 1
+
+
+def sequence_number(message):
+    """Returns the sequence number a SequencedPort tagged a message with, or None for any other message.
+    """
+    if len(message) != 6 or message[:2] != [0xF0, 0x7D]:
+        return None
+    return (message[2] << 14) | (message[3] << 7) | message[4]
+
+
+def open_loopback(kind):
+    """Opens the requested loopback, falling back from virtual to fake when kind is 'auto'.
+    """
+    if kind == "fake":
+        return FakeLoopback()
+    try:
+        return VirtualLoopback()
+    except Exception as error:
+        if kind == "virtual":
+            raise
+        print("virtual loopback unavailable ({}), using in-process fake port".format(error), file=sys.stderr)
+        return FakeLoopback()
+
+
+
+# --------- #
+# Scenarios #
+# --------- #
+
+def cc_flood(queue, duration):
+    """Sixteen channels of fine grained cc_linear sweeps."""
+    return [[0, musx_reaper.cc_linear(queue, chan=chan, ctrl=1, length=duration, start=0, end=1, grain=0.005)] for chan in range(16)]
+
+
+def euclid_stack(queue, duration):
+    """Forty-eight overlapping sixteen step euclidean_rhythm patterns."""
+    return [[0, musx_reaper.euclidean_rhythm(queue, chan=i % 16, length=duration, keynum=36 + i, events=1 + (i * 5) % 16, positions=16, cycletime=1, rotation=i % 16)] for i in range(48)]
+
+
+def drunk_ensemble(queue, duration):
+    """Twenty-four drunk_walker voices with short notes."""
+    notes = musx.scale(36, 36, 2, 2, 1, 2, 2, 2, 1)
+    return [[0, musx_reaper.drunk_walker(queue, chan=i % 16, length=duration, notes=notes, dur=0.1)] for i in range(24)]
+
+
+"Benchmark scenarios by name."
+scenarios = {"cc": cc_flood, "euclid": euclid_stack, "drunk": drunk_ensemble}
+
+
+
+# --------- #
+# Measuring #
+# --------- #
+
+def percentiles(values, points=(50, 90, 99)):
+    """Returns the given percentiles and the maximum of a list of numbers, or Nones for an empty list.
+    """
+    if not values:
+        return {**{"p{}".format(p): None for p in points}, "max": None}
+    ordered = sorted(values)
+    result = {"p{}".format(p): ordered[min(len(ordered) - 1, round(p / 100 * (len(ordered) - 1)))] for p in points}
+    result["max"] = ordered[-1]
+    return result
+
+
+def run_scenario(name, duration, port_kind):
+    """Renders one scenario, plays it into a fresh loopback and measures what arrives.
+
+    Returns:
+        dictionary of measurements, times in milliseconds
+    """
+    buffer = musx_reaper.EventBuffer()
+    queue = musx.Scheduler(out=buffer)
+    queue.compose(scenarios[name](queue, duration))
+    times = [event.time for event in buffer.toseq()]
+
+    loopback = open_loopback(port_kind)
+    player = musx_reaper.play(buffer, SequencedPort(loopback), block=True)
+    # Give the input callback a moment to drain
+    time.sleep(0.2)
+    loopback.close()
+
+    # First arrival of each sequence number, anything untagged or duplicated is ignored
+    arrivals = {}
+    for stamp, message in list(loopback.arrivals):
+        seq = sequence_number(list(message))
+        if seq is not None and seq < player.sent:
+            arrivals.setdefault(seq, stamp)
+    latencies = [(stamp - (player.started + times[seq])) * 1000 for seq, stamp in arrivals.items()]
+    median = statistics.median(latencies) if latencies else 0
+    jitter = [abs(latency - median) for latency in latencies]
+    elapsed = (max(arrivals.values()) - player.started) if arrivals else 0
+
+    return {
+        "scenario": name,
+        "port": loopback.name,
+        "sent": player.sent,
+        "received": len(arrivals),
+        "dropped": player.sent - len(arrivals),
+        "throughput": len(arrivals) / elapsed if elapsed > 0 else 0,
+        "latency_ms": percentiles(latencies),
+        "jitter_ms": percentiles(jitter),
+    }
+
+
+def format_result(result):
+    """Formats one scenario's measurements as a short report.
+    """
+    def row(label, stats):
+        return "  {:<8} ".format(label) + "  ".join("{} {:>8.3f}".format(key, value) if value is not None else "{} {:>8}".format(key, "-") for key, value in stats.items())
+
+    return "\n".join([
+        "{} ({} port): {} sent, {} received, {} dropped, {:.0f} msgs/s".format(result["scenario"], result["port"], result["sent"], result["received"], result["dropped"], result["throughput"]),
+        row("latency", result["latency_ms"]),
+        row("jitter", result["jitter_ms"]),
+    ])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure musx_reaper playback latency and jitter through a loopback port.")
+    parser.add_argument("--scenario", choices=["all"] + list(scenarios), default="all")
+    parser.add_argument("--duration", type=float, default=5, help="seconds of music per scenario")
+    parser.add_argument("--port", choices=["auto", "virtual", "fake"], default="auto")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    names = list(scenarios) if args.scenario == "all" else [args.scenario]
+    results = [run_scenario(name, args.duration, args.port) for name in names]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print("\n\n".join(format_result(result) for result in results))
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -1,42 +1,668 @@
+import array
+import asyncio
+import bisect
+import collections
+import concurrent.futures
+import fractions
+import functools
+import heapq
+import json
+import math
+import queue as queue_module
 import musx
 import rtmidi
 import rtmidi.midiconstants
+import threading
+import time
+
+try:
+    import numpy as np
+except ImportError: # numpy is only needed for pregenerated note generators
+    np = None
+
+
+
+# ------------------------ #
+# Library Global Variables #
+# ------------------------ #
+
+"Mapping of curve shape names to the musx.envelopes interpolation mode that draws them."
+curve_shapes = {"lin": "lin", "exp": "exp", "log": "-exp", "scurve": "cos"}
+
+"List of valid musx.envelopes interpolation modes, used for error handling."
+valid_curve_modes = ["lin", "cos", "exp", "-exp"]
+
+"Reset messages sent on every channel by panic, built once: all sound off, all notes off and reset all controllers."
+_panic_messages = [[rtmidi.midiconstants.CONTROL_CHANGE | channel, ctrl, 0]
+                   for channel in range(16)
+                   for ctrl in (rtmidi.midiconstants.ALL_SOUND_OFF, rtmidi.midiconstants.ALL_NOTES_OFF, rtmidi.midiconstants.RESET_ALL_CONTROLLERS)]
+
+"MIDI Time Code frame rates and their rate code in the hours quarter frame. 29.97 drop frame is not supported."
+mtc_rates = {24: 0, 25: 1, 30: 3}
+
+"Ranks used to order note-offs, transport and locate messages, other messages and note-ons that share a time stamp."
+_NOTE_OFF_RANK, _TRANSPORT_RANK, _OTHER_RANK, _NOTE_ON_RANK = 0, 1, 2, 3
+
+"System messages that start or locate playback, they rank ahead of the clock ticks and quarter frames they go with: sysex (MTC full frame), song position pointer, start and continue."
+_transport_statuses = (0xF0, 0xF2, 0xFA, 0xFB)
+
+"RandomLog that random draws are currently recorded to or replayed from, None when neither."
+_random_log = None
 
 
 # ------------------- #
 # MIDI Port Functions # 
 # ------------------- #
 
-def panic(port):
+def panic(port, *, notes=None, close=True, timeout=1.0):
     """Severs a MIDI connection, in case of emergency.
-    Sends note-off and control change reset messages on all channels.
-    Closes down the MIDI port.
+    Sends all sound off, all notes off and reset all controllers on all channels,
+    preceded by a note-off for each sounding note given. Closes down the MIDI port.
+    A list of ports is silenced concurrently, one thread per port, waiting no longer than timeout.
+    Notes left sounding on a TrackedPort are released automatically.
 
     Arguments:
-        port: rtmidi MidiOut object, port to be closed down 
+        port: rtmidi MidiOut object or list of them, port(s) to be closed down
+        notes: iterable of (chan, key) pairs, sounding notes to send individual note-offs for, defaults to None
+        close: boolean, whether to close the port(s) after silencing them, defaults to True
+        timeout: number, seconds to wait for a list of ports to finish, defaults to 1
+
+    Returns:
+        list of ports that did not finish within timeout, empty if all of them did
+    """
+    notes = list(notes) if notes else []
+
+    if not isinstance(port, (list, tuple)):
+        _silence(port, notes, close)
+        return []
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(port)))
+    futures = {executor.submit(_silence, p, notes, close): p for p in port}
+    _, pending = concurrent.futures.wait(futures, timeout=timeout)
+    executor.shutdown(wait=False)
+    return [futures[future] for future in pending]
+
+
+def _silence(port, notes, close):
+    """Sends note-offs and the prebuilt reset messages out a port and optionally closes it, the per-port body of panic.
     """
-    for channel in range(16):
-        port.send_message([rtmidi.midiconstants.CONTROL_CHANGE, rtmidi.midiconstants.ALL_SOUND_OFF, 0])
-        port.send_message([rtmidi.midiconstants.CONTROL_CHANGE, rtmidi.midiconstants.RESET_ALL_CONTROLLERS, 0])
-    port.close_port()
+    if isinstance(port, TrackedPort):
+        port.release()
+    send = port.send_message
+    for chan, key in notes:
+        send([rtmidi.midiconstants.NOTE_OFF | chan, key, 0])
+    for message in _panic_messages:
+        send(message)
+    if close:
+        port.close_port()
 
 
 def midi_restart(port, portname):
     """Closes a MIDI port and opens another.
     
+    A PortHandle (or a TrackedPort around one) is silenced and then reconnected in the background instead,
+    it keeps accepting messages throughout and is returned as is.
+
     Arguments:
-        port: rtmidi MidiOut object, port to be closed down
+        port: rtmidi MidiOut, TrackedPort or PortHandle object, port to be closed down
         portname: string, name of MIDI port to reopen
 
     Returns:
-        rtmidi MidiOut object, the opened MIDI port.
+        rtmidi MidiOut object, the opened MIDI port, wrapped in a TrackedPort if the closed one was.
     """
+    handle = port.port if isinstance(port, TrackedPort) else port
+    if isinstance(handle, PortHandle):
+        panic(port, close=False)
+        handle.reconnect()
+        return port
+
     panic(port)
     newport = rtmidi.MidiOut()
     newport.open_port(newport.get_ports().index(portname))
+    if isinstance(port, TrackedPort):
+        return TrackedPort(newport, port.tracker)
     return newport
 
 
+# --------------- #
+# Port Management #
+# --------------- #
+
+class PortManager:
+    """Keeps named output ports open and remembers where they are.
+    Port indices are cached and only re-enumerated when the cached index no longer has the expected name,
+    since listing ports behind a virtual cable can take tens of milliseconds.
+
+    Example:
+        ports = musx_reaper.PortManager()
+        midiout = ports.open('musx2reaper 1')
+        musx_reaper.play(seq, midiout, False)
+        midiout = musx_reaper.midi_restart(midiout, 'musx2reaper 1')
+    """
+
+    def __init__(self):
+        self.handles = {}
+        self._indices = {}
+        self._probe = None
+        self._lock = threading.Lock()
+
+    def index(self, name):
+        """Finds a port's index, trusting the cached one if its name still matches.
+
+        Arguments:
+            name: string, name of the MIDI port
+
+        Returns:
+            int, index of the port
+
+        Raises:
+            ValueError: no port with the name exists
+        """
+        with self._lock:
+            if self._probe is None:
+                self._probe = rtmidi.MidiOut()
+            cached = self._indices.get(name)
+            if cached is not None and cached < self._probe.get_port_count() and self._probe.get_port_name(cached) == name:
+                return cached
+            ports = self._probe.get_ports()
+            if name not in ports:
+                raise ValueError("MIDI port '{}' is not in available ports: {}".format(name, ', '.join(ports)))
+            self._indices[name] = ports.index(name)
+            return self._indices[name]
+
+    def open(self, name):
+        """Opens a named port, or returns the handle already open for it.
+
+        Arguments:
+            name: string, name of the MIDI port
+
+        Returns:
+            PortHandle object, handle to the open port
+        """
+        handle = self.handles.get(name)
+        if handle is None or not handle.is_port_open():
+            handle = PortHandle(self, name)
+            self.handles[name] = handle
+        return handle
+
+    def close_all(self):
+        """Closes every port opened through the manager.
+        """
+        for handle in self.handles.values():
+            handle.close_port()
+        self.handles.clear()
+
+
+class PortHandle:
+    """Stand-in for a named output port whose underlying rtmidi MidiOut can be swapped while it is being played.
+    Messages sent during a reconnect are queued and flushed in order once the new port is in place,
+    so a running Player keeps going without losing anything. A spare MidiOut is created ahead of time
+    so a reconnect only has to open it. Anything other than send_message is passed through to the current port.
+
+    Arguments:
+        manager: PortManager object, manager the handle belongs to
+        name: string, name of the MIDI port
+    """
+
+    def __init__(self, manager, name):
+        self.manager = manager
+        self.name = name
+        self.latencies = []
+        self.port = rtmidi.MidiOut()
+        self.port.open_port(manager.index(name))
+        self._pending = collections.deque()
+        self._reconnecting = False
+        self._lock = threading.Lock()
+        self._spare = None
+        self._thread = None
+        self._prepare_spare()
+
+    def __getattr__(self, name):
+        # Only reached when normal lookup fails, port itself missing means __init__ never got that far
+        if name == "port":
+            raise AttributeError(name)
+        return getattr(self.port, name)
+
+    def _prepare_spare(self):
+        def make_spare():
+            spare = rtmidi.MidiOut()
+            with self._lock:
+                if self._spare is None:
+                    self._spare = spare
+        threading.Thread(target=make_spare, daemon=True).start()
+
+    def send_message(self, message):
+        """Sends a message out the current port, or queues it while a reconnect is underway.
+
+        Arguments:
+            message: list of ints, MIDI message bytes
+        """
+        with self._lock:
+            if self._reconnecting:
+                self._pending.append(message)
+            else:
+                self.port.send_message(message)
+
+    def reconnect(self, background=True):
+        """Opens the port again and swaps it in for the current one, which is then closed.
+
+        Arguments:
+            background: boolean, whether to reconnect on a background thread, defaults to True
+        """
+        with self._lock:
+            if self._reconnecting:
+                return
+            self._reconnecting = True
+        if background:
+            self._thread = threading.Thread(target=self._reconnect, daemon=True)
+            self._thread.start()
+        else:
+            self._reconnect()
+
+    def _reconnect(self):
+        started = time.perf_counter()
+        with self._lock:
+            newport, self._spare = self._spare, None
+        if newport is None:
+            newport = rtmidi.MidiOut()
+        try:
+            newport.open_port(self.manager.index(self.name))
+        except Exception:
+            with self._lock:
+                self._reconnecting = False
+            raise
+        with self._lock:
+            oldport, self.port = self.port, newport
+            while self._pending:
+                newport.send_message(self._pending.popleft())
+            self._reconnecting = False
+        oldport.close_port()
+        self.latencies.append(time.perf_counter() - started)
+        self._prepare_spare()
+
+    def wait(self):
+        """Blocks until a background reconnect has finished.
+        """
+        if self._thread is not None:
+            self._thread.join()
+
+    def latency_stats(self):
+        """Summarizes how long reconnects have taken, from starting to open the port to the swap.
+
+        Returns:
+            dictionary with count, last, mean and max in seconds, times are None before the first reconnect
+        """
+        if not self.latencies:
+            return {"count": 0, "last": None, "mean": None, "max": None}
+        return {"count": len(self.latencies), "last": self.latencies[-1], "mean": sum(self.latencies) / len(self.latencies), "max": max(self.latencies)}
+
+
+# ------------ #
+# Port Routing #
+# ------------ #
+
+class QueuedPort:
+    """Wraps a port so that sending only queues the message, a dedicated thread does the actual sending.
+    Useful for slow destinations like loggers that shouldn't hold up the others.
+    Anything other than send_message is passed through to the wrapped port.
+
+    Arguments:
+        port: object with a send_message method, port to send through
+    """
+
+    def __init__(self, port):
+        self.port = port
+        self._queue = queue_module.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def __getattr__(self, name):
+        return getattr(self.port, name)
+
+    def _run(self):
+        send = self.port.send_message
+        while True:
+            message = self._queue.get()
+            if message is None:
+                break
+            send(message)
+
+    def send_message(self, message):
+        """Queues a message to be sent out the wrapped port.
+
+        Arguments:
+            message: list of ints, MIDI message bytes
+        """
+        self._queue.put(message)
+
+    def close_port(self):
+        """Sends whatever is still queued, then closes the wrapped port.
+        """
+        self._queue.put(None)
+        self._thread.join()
+        self.port.close_port()
+
+
+class MidiRouter:
+    """Fans messages out to several ports according to routes on channel and optionally key or controller range.
+    Routes are compiled into a flat table indexed by status byte and first data byte, each entry holding the tuple
+    of destination ports, so sending is one lookup however many routes there are. Each message is built once and
+    the same list is handed to every destination. With parallel, each destination sends on its own thread.
+    A router has a send_message method, so it can be played through like any port.
+
+    Example:
+        router = musx_reaper.MidiRouter()
+        router.add_route(reaper)
+        router.add_route(synth, chans=[0, 1], data_range=(36, 96))
+        router.add_route(logger)
+        musx_reaper.play(seq, router)
+
+    Arguments:
+        parallel: boolean, whether each destination sends on its own thread, defaults to False
+    """
+
+    def __init__(self, *, parallel=False):
+        self.parallel = parallel
+        self.routes = []
+        self._queued = {}
+        self._table = None
+
+    def add_route(self, port, *, chans=None, data_range=None):
+        """Sends matching messages to a port.
+
+        Arguments:
+            port: object with a send_message method, destination port
+            chans: list of ints (0-indexed), channels to route, defaults to all channels
+            data_range: pair of ints, inclusive range of key numbers (note messages) or controllers
+                (control changes) to route, defaults to all, other channel messages ignore it
+
+        Raises:
+            ValueError: channel or data range out of bounds
+        """
+        if chans is not None and any(chan < 0 or chan > 15 for chan in chans):
+            raise ValueError("Channels must be between 0 and 15")
+        if data_range is not None and not 0 <= data_range[0] <= data_range[1] <= 127:
+            raise ValueError("Data range must be a low, high pair between 0 and 127")
+
+        if self.parallel and id(port) not in self._queued:
+            self._queued[id(port)] = QueuedPort(port)
+        self.routes.append((port, None if chans is None else set(chans), data_range))
+        self._table = None
+
+    def compile(self):
+        """Builds the routing table, this happens automatically on the first send after routes change.
+        """
+        table = []
+        interned = {}
+        for status in range(256):
+            kind = status & 0xF0
+            for data1 in range(128):
+                dests = []
+                for port, chans, data_range in self.routes:
+                    if status >= 0xF0:
+                        # System messages have no channel, they go to routes that take every channel
+                        matched = chans is None
+                    else:
+                        matched = chans is None or status & 0x0F in chans
+                        if matched and data_range is not None and kind in (0x80, 0x90, 0xA0, 0xB0):
+                            matched = data_range[0] <= data1 <= data_range[1]
+                    if matched:
+                        dest = self._queued.get(id(port), port)
+                        if dest not in dests:
+                            dests.append(dest)
+                dests = tuple(dests)
+                table.append(interned.setdefault(dests, dests))
+        self._table = table
+
+    def destinations(self, message):
+        """Looks up where a message would be sent.
+
+        Arguments:
+            message: list of ints, MIDI message bytes
+
+        Returns:
+            tuple of destination ports
+        """
+        if self._table is None:
+            self.compile()
+        return self._table[(message[0] << 7) | (message[1] & 0x7F if len(message) > 1 else 0)]
+
+    def send_message(self, message):
+        """Sends a message to every destination routed for it.
+
+        Arguments:
+            message: list of ints, MIDI message bytes
+        """
+        for port in self.destinations(message):
+            port.send_message(message)
+
+    def close_port(self):
+        """Closes every destination port.
+        """
+        closed = set()
+        for port, _, _ in self.routes:
+            if id(port) not in closed:
+                closed.add(id(port))
+                self._queued.get(id(port), port).close_port()
+
+
+# ------------- #
+# Note Tracking #
+# ------------- #
+
+class NoteTracker:
+    """Counts sounding notes by channel and key.
+    Counts live in a flat 16x128 array indexed by (chan << 7) | key, so updating it per event costs an index and an add.
+    Counts are references, a key struck twice needs two note-offs before it is silent.
+    """
+
+    def __init__(self):
+        self.counts = array.array("H", bytes(2 * 16 * 128))
+        self.active = 0
+
+    def update(self, message):
+        """Updates counts from an outgoing MIDI message, anything other than a note-on or note-off is ignored.
+
+        Arguments:
+            message: list of ints, MIDI message bytes
+        """
+        kind = message[0] & 0xF0
+        if kind != 0x90 and kind != 0x80:
+            return
+        index = ((message[0] & 0x0F) << 7) | message[1]
+        if kind == 0x90 and message[2] > 0:
+            self.counts[index] += 1
+            self.active += 1
+        elif self.counts[index] > 0:
+            self.counts[index] -= 1
+            self.active -= 1
+
+    def sounding(self):
+        """Lists sounding notes, once per outstanding note-on.
+
+        Returns:
+            list of (chan, key) pairs
+        """
+        if self.active == 0:
+            return []
+        return [(index >> 7, index & 0x7F) for index, count in enumerate(self.counts) for _ in range(count)]
+
+    def clear(self):
+        """Forgets all sounding notes.
+        """
+        if self.active:
+            self.counts = array.array("H", bytes(2 * 16 * 128))
+            self.active = 0
+
+
+class TrackedPort:
+    """Wraps an rtmidi MidiOut so that every message sent through it updates a NoteTracker.
+    Anything other than send_message is passed through to the wrapped port.
+    Leaving a with block, normally or by an exception, releases whatever is still sounding.
+
+    Arguments:
+        port: rtmidi MidiOut object, open port to wrap
+        tracker: NoteTracker object, tracker to update, defaults to a new one
+    """
+
+    def __init__(self, port, tracker=None):
+        self.port = port
+        self.tracker = NoteTracker() if tracker is None else tracker
+
+    def __getattr__(self, name):
+        return getattr(self.port, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+        return False
+
+    def send_message(self, message):
+        """Sends a message out the wrapped port and records it in the tracker.
+
+        Arguments:
+            message: list of ints, MIDI message bytes
+        """
+        self.tracker.update(message)
+        self.port.send_message(message)
+
+    def release(self):
+        """Sends exactly one note-off per outstanding note-on and clears the tracker.
+        """
+        for chan, key in self.tracker.sounding():
+            self.port.send_message([rtmidi.midiconstants.NOTE_OFF | chan, key, 0])
+        self.tracker.clear()
+
+
+# ------------- #
+# Random Replay #
+# ------------- #
+
+class RandomLog:
+    """Records every random value musx_reaper's generators draw, so that a run can be replayed exactly.
+    Values are kept as one flat array of doubles in draw order. The scheduler runs composers in a fixed order on
+    its virtual clock, so the order of draws is the same on every run of the same composition.
+    While replaying, draws are read back from the log and the random functions are not called at all.
+    Pregenerated note generators only log the seed of their numpy generator.
+
+    Example:
+        log = musx_reaper.RandomLog()
+        with log.record():
+            queue.compose(...)
+        log.save("take.rlog")
+        with musx_reaper.RandomLog.load("take.rlog").replay():
+            queue.compose(...)
+    """
+
+    def __init__(self, values=()):
+        self.values = array.array("d", values)
+        self.position = 0
+        self.replaying = False
+        self._previous = None
+
+    def __len__(self):
+        return len(self.values)
+
+    def __enter__(self):
+        global _random_log
+        self._previous = _random_log
+        _random_log = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global _random_log
+        _random_log = self._previous
+        self._previous = None
+        return False
+
+    def record(self):
+        """Clears the log and switches it to recording, use as a context manager.
+
+        Returns:
+            the RandomLog
+        """
+        del self.values[:]
+        self.position = 0
+        self.replaying = False
+        return self
+
+    def replay(self):
+        """Rewinds the log and switches it to replaying, use as a context manager.
+
+        Returns:
+            the RandomLog
+        """
+        self.position = 0
+        self.replaying = True
+        return self
+
+    def draw(self, function, *args):
+        """Calls a random function and logs its result, or returns the next logged value when replaying.
+
+        Arguments:
+            function: function returning a number, e.g. musx.uniran
+            args: arguments to pass to function
+
+        Raises:
+            ValueError: the log ran out of values while replaying
+
+        Returns:
+            number, the drawn or replayed value
+        """
+        if not self.replaying:
+            value = function(*args)
+            self.values.append(value)
+            return value
+        if self.position >= len(self.values):
+            raise ValueError("Random log exhausted after {} values, the composition has diverged from the recording".format(len(self.values)))
+        value = self.values[self.position]
+        self.position += 1
+        return value
+
+    def save(self, path):
+        """Writes the logged values to a file as raw doubles.
+
+        Arguments:
+            path: string, filepath to write to
+        """
+        with open(path, "wb") as log_file:
+            self.values.tofile(log_file)
+
+    @classmethod
+    def load(cls, path):
+        """Reads a log written by save.
+
+        Arguments:
+            path: string, filepath to read from
+
+        Returns:
+            RandomLog object
+        """
+        log = cls()
+        with open(path, "rb") as log_file:
+            log.values.frombytes(log_file.read())
+        return log
+
+
+def recorded(function):
+    """Wraps a random function so its results go through the active RandomLog, e.g. recorded(musx.odds).
+    Replayed values come back as floats, so booleans from musx.odds replay as 0.0 or 1.0.
+
+    Arguments:
+        function: function returning a number
+
+    Returns:
+        function taking the same arguments
+    """
+    @functools.wraps(function)
+    def wrapper(*args):
+        return _draw(function, *args)
+    return wrapper
+
+
+
 # ---------------- #
 # Helper Functions #
 # ---------------- #
@@ -48,6 +674,7 @@ def bjorklund(events, positions):
     For example, the Cuban tresillo [x . . x . . x .] can be produced from bjorklund(3, 8), which is
     three events spaced out in an eight positions as evenly as possible.
     See http://cgm.cs.mcgill.ca/~godfried/publications/banff.pdf for more details.
+    Patterns are memoized, so only the first call for a given events/positions pair runs the algorithm.
     
     Arguments:
         events: int, number of active events to place
@@ -59,6 +686,13 @@ def bjorklund(events, positions):
     Raises:
         ValueError: There are either zero events or more events than positions.
     """
+    return list(_bjorklund_pattern(events, positions))
+
+
+@functools.lru_cache(maxsize=4096)
+def _bjorklund_pattern(events, positions):
+    """Memoized body of bjorklund, returns the pattern as immutable bytes so cached results can be shared.
+    """
     if events > positions:
         raise ValueError("Number of events cannot exceed number of positions")
     if events == 0:
@@ -78,7 +712,283 @@ def bjorklund(events, positions):
             sequences = sequences[:-1 * diff].copy()
     
     # List flattening comprehension from here: https://stackoverflow.com/questions/11264684/flatten-list-of-lists
-    return [val for sublist in sequences for val in sublist]
+    return bytes([val for sublist in sequences for val in sublist])
+
+
+@functools.lru_cache(maxsize=4096)
+def _bjorklund_mask(events, positions):
+    """Memoized bitmask form of bjorklund, bit i is set when position i holds an event.
+    """
+    return sum(1 << i for i, val in enumerate(_bjorklund_pattern(events, positions)) if val)
+
+
+def euclidean_mask(events, positions, rotation=0):
+    """Euclidean rhythm as an int bitmask, see bjorklund.
+    The unrotated pattern is memoized and rotation is a constant time bit rotation,
+    so thousands of rhythms cost little more than a dictionary lookup to set up.
+
+    Arguments:
+        events: int, number of active events to place
+        positions: int, total number of positions that events can be placed
+        rotation: int, position within the rhythm to start at
+
+    Returns:
+        int, bit i is set when the i-th position played (counting from rotation) holds an event.
+
+    Raises:
+        ValueError: There are either zero events or more events than positions.
+    """
+    mask = _bjorklund_mask(events, positions)
+    rotation %= positions
+    return ((mask >> rotation) | (mask << (positions - rotation))) & ((1 << positions) - 1)
+
+
+def _add_note(out, time, dur, key, chan, amp=0.5):
+    """Adds a note to a scheduler's output.
+    Outputs that provide addnote take the note as plain numbers, anything else gets a musx MidiNote.
+    """
+    if hasattr(out, "addnote"):
+        out.addnote(time, dur, key, chan, amp)
+    else:
+        out.addevent(musx.MidiNote(time=time, dur=dur, key=key, amp=amp, chan=chan))
+
+
+def _add_cc(out, time, chan, ctrl, val):
+    """Adds a control change to a scheduler's output.
+    Outputs that provide addcc take the message as plain numbers, anything else gets a musx MidiEvent.
+    """
+    if hasattr(out, "addcc"):
+        out.addcc(time, chan, ctrl, val)
+    else:
+        out.addevent(musx.MidiEvent.control_change(chan, ctrl, val, time=time))
+
+
+def _add_message(out, time, message):
+    """Adds a raw MIDI message to a scheduler's output.
+    Outputs that provide addmessage take the message bytes as they are, anything else gets a musx MidiEvent.
+    """
+    if hasattr(out, "addmessage"):
+        out.addmessage(time, message)
+    else:
+        out.addevent(musx.MidiEvent(message, time=time))
+
+
+def _event_count(out):
+    """Number of events held by a scheduler's output, 0 when there is no output or it can't be counted.
+    """
+    return len(out) if hasattr(out, "__len__") else 0
+
+
+def _mtc_fields(frame, fps):
+    """Splits an absolute frame count into hours, minutes, seconds and frames.
+    """
+    return frame // (fps * 3600) % 24, frame // (fps * 60) % 60, frame // fps % 60, frame % fps
+
+
+def _mtc_pieces(frame, fps):
+    """Splits an absolute frame count into the eight MIDI Time Code quarter frame messages that describe it.
+    """
+    hours, minutes, seconds, frames = _mtc_fields(frame, fps)
+    values = [frames & 0x0F, frames >> 4,
+              seconds & 0x0F, seconds >> 4,
+              minutes & 0x0F, minutes >> 4,
+              hours & 0x0F, (mtc_rates[fps] << 1) | (hours >> 4)]
+    return [[0xF1, (piece << 4) | value] for piece, value in enumerate(values)]
+
+
+def _add_notes(out, times, durs, keys, chan, amp=0.5):
+    """Adds a batch of notes held in numpy arrays to a scheduler's output.
+    Outputs that provide addnotes take the arrays whole, anything else gets the notes one at a time.
+    """
+    if hasattr(out, "addnotes"):
+        out.addnotes(times, durs, keys, chan, amp)
+    else:
+        for when, dur, key in zip(times.tolist(), durs.tolist(), keys.tolist()):
+            _add_note(out, when, dur, key, chan, amp)
+
+
+def _draw(function, *args):
+    """Calls a random function, through the active RandomLog if there is one.
+    """
+    if _random_log is None:
+        return function(*args)
+    return _random_log.draw(function, *args)
+
+
+def _choose(items):
+    """musx.choose that goes through the active RandomLog, logging the index of each choice.
+    """
+    chooser = musx.choose(items)
+    while True:
+        yield items[int(_draw(lambda: items.index(next(chooser))))]
+
+
+def _drunk(start, width):
+    """musx.drunk that goes through the active RandomLog, logging each value of the walk.
+    """
+    walker = musx.drunk(start, width)
+    while True:
+        yield _draw(next, walker)
+
+
+def _numpy_rng():
+    """Makes a numpy random generator seeded from musx's random stream, so seeding Python's random module
+    also fixes the outcome of the pregenerated note generators.
+
+    Raises:
+        ImportError: numpy is not installed
+    """
+    if np is None:
+        raise ImportError("Pregenerated note generators require numpy")
+    return np.random.default_rng(int(_draw(musx.uniran) * 2**53))
+
+
+def _draw_batch(distribution, count, rng):
+    """Draws count values from a distribution function at once.
+    musx's uniran/lowran/midran/highran are rebuilt from numpy uniform draws, any other function is called count times.
+    """
+    if distribution is musx.uniran:
+        return rng.random(count)
+    if distribution is musx.lowran:
+        return rng.random((2, count)).min(axis=0)
+    if distribution is musx.midran:
+        return rng.random((2, count)).mean(axis=0)
+    if distribution is musx.highran:
+        return rng.random((2, count)).max(axis=0)
+    return np.fromiter((_draw(distribution) for _ in range(count)), dtype=np.float64, count=count)
+
+
+def _reflect_batch(values, lb, ub):
+    """Vectorized musx.fit(value, lb, ub, mode='reflect') for an array of ints.
+    """
+    span = ub - lb
+    if span == 0:
+        return np.full_like(values, lb)
+    folded = (values - lb) % (2 * span)
+    return np.where(folded > span, 2 * span - folded, folded) + lb
+
+
+def _varlen(value):
+    """Encodes a non-negative int as a MIDI variable length quantity.
+    """
+    encoded = [value & 0x7F]
+    value >>= 7
+    while value:
+        encoded.append((value & 0x7F) | 0x80)
+        value >>= 7
+    return bytes(reversed(encoded))
+
+
+def _tie_rank(status, data2):
+    """Sort rank of a message among others at the same time.
+    Note-offs come first and note-ons last, the same ordering musx.MidiSeq.addevent uses,
+    and transport and locate messages come before the clock ticks and quarter frames that follow them.
+    """
+    if status in _transport_statuses:
+        return _TRANSPORT_RANK
+    kind = status & 0xF0
+    if kind == 0x80 or (kind == 0x90 and data2 == 0):
+        return _NOTE_OFF_RANK
+    if kind == 0x90:
+        return _NOTE_ON_RANK
+    return _OTHER_RANK
+
+
+def _snap(value, grid, tolerance=1e-9):
+    """Snaps a value onto the nearest value of a sorted grid when within tolerance, otherwise returns it unchanged.
+    Used to land note-offs computed as onset + dur exactly on the onset of a following note.
+    """
+    index = bisect.bisect_left(grid, value)
+    for near in grid[max(index - 1, 0):index + 1]:
+        if abs(near - value) <= tolerance:
+            return near
+    return value
+
+
+def _off_rank(on, off):
+    """Sort rank of a note's own note-off given its on and off times (or ticks).
+    A note-off that lands on its own note-on ranks with the note-ons, so that insertion order puts it after the on.
+    """
+    return _NOTE_OFF_RANK if off > on else _NOTE_ON_RANK
+
+
+def _message_length(status):
+    """Number of bytes in a channel or system message with the given status byte, including the status byte.
+    """
+    if status < 0xF0:
+        return 2 if status & 0xF0 in (0xC0, 0xD0) else 3
+    if status in (0xF1, 0xF3):
+        return 2
+    if status == 0xF2:
+        return 3
+    return 1
+
+
+def curve_changes(env, length, *, low=0, high=1, mode="lin", step=1, grain=0.01):
+    """Finds the times at which a breakpoint envelope changes its control change value.
+    The envelope's x values are stretched to span length seconds and its y values are remapped from low/high to 0-127.
+    Each segment is monotonic, so the moment the curve crosses the rounding boundary of the next value can be
+    found by bisection instead of by sampling the curve at a fixed rate.
+
+    Arguments:
+        env: list of numbers, flat list of x, y pairs in the style of musx.Env, x values monotonically increasing
+        length: number, total number of seconds the envelope spans
+        low: number, minimum value according to the envelope's y scale
+        high: number, maximum value according to the envelope's y scale
+        mode: string, musx.envelopes interpolation mode, one of 'lin', 'cos', 'exp' or '-exp'
+        step: int, smallest change in control change value worth sending
+        grain: number, minimum number of seconds between two changes, closer changes are merged
+
+    Returns:
+        A list of [time, value] pairs, starting at time zero, where value is an int between 0 and 127.
+
+    Raises:
+        ValueError: malformed envelope, unknown mode or nonsense step
+    """
+    if mode not in valid_curve_modes:
+        raise ValueError("Specified curve mode '{}' is not in supported list of curve modes: {}".format(mode, ', '.join(valid_curve_modes)))
+    if len(env) < 4 or len(env) % 2 != 0:
+        raise ValueError("Envelope must be a flat list of at least two x, y pairs")
+    if env[-2] <= env[0]:
+        raise ValueError("Envelope x values must increase")
+    if step < 1:
+        raise ValueError("Step must be 1 or greater")
+
+    times = [musx.rescale(x, env[0], env[-2], 0, length) for x in env[0::2]]
+    vals = [musx.rescale(y, low, high, 0, 127) for y in env[1::2]]
+    tolerance = length * 1e-6
+
+    current = round(vals[0])
+    changes = [[0.0, current]]
+    for seg in range(len(times) - 1):
+        t1, t2, v1, v2 = times[seg], times[seg + 1], vals[seg], vals[seg + 1]
+        target = round(v2)
+        while abs(target - current) >= step:
+            direction = 1 if target > current else -1
+            current += direction * step
+            threshold = current - direction * 0.5
+            lo, hi = t1, t2
+            while hi - lo > tolerance:
+                mid = (lo + hi) / 2
+                if (musx.rescale(mid, t1, t2, v1, v2, mode) - threshold) * direction >= 0:
+                    hi = mid
+                else:
+                    lo = mid
+            changes.append([hi, current])
+    if round(vals[-1]) != current:
+        changes.append([length, round(vals[-1])])
+
+    # Changes closer than grain are pushed back onto a grain-spaced slot, later values overwrite a slot not yet reached
+    merged = []
+    for when, val in changes:
+        if not merged or when >= merged[-1][0] + grain:
+            merged.append([when, val])
+        elif merged[-1][0] >= when:
+            merged[-1][1] = val
+        else:
+            merged.append([merged[-1][0] + grain, val])
+
+    return [change for i, change in enumerate(merged) if i == 0 or change[1] != merged[i - 1][1]]
 
 
 # ------------------------- #
@@ -97,7 +1007,7 @@ def cc_message(queue, *, chan, ctrl, value):
     Yields:
         nothing, yields zero to satisfy requirements for musx Scheduler.
     """
-    queue.out.addevent(musx.MidiEvent.control_change(chan, ctrl, value, time=queue.now))
+    _add_cc(queue.out, queue.now, chan, ctrl, value)
     yield 0
 
 
@@ -124,11 +1034,69 @@ def cc_linear(queue, *, chan, ctrl, length, start, end, low=0, high=1, grain=0.0
     step = (end_rescale - start_rescale) / (length / grain)
     val = start_rescale
     for _ in musx.frange(0, length + grain, grain):
-        queue.out.addevent(musx.MidiEvent.control_change(chan, ctrl, round(val), time=queue.now))
+        _add_cc(queue.out, queue.now, chan, ctrl, round(val))
         val += step
         yield grain
 
 
+def cc_curve(queue, *, chan, ctrl, length, env, low=0, high=1, mode="lin", step=1, grain=0.01):
+    """Changes a control change value over time along a breakpoint envelope.
+    Rather than sending at a fixed grain, a message is only sent once the curve has moved by step,
+    so plateaus cost nothing and steep sections are sent as densely as they need to be.
+
+    Arguments:
+        queue: musx Scheduler object, scheduler to add events to
+        chan: int (0-indexed), MIDI channel to send control change messages to
+        ctrl: int (0-indexed), control change number
+        length: number, total number of seconds for the envelope to take
+        env: list of numbers, flat list of x, y pairs in the style of musx.Env, x values are stretched to span length
+        low: number, minimum value according to the envelope's y scale
+        high: number, maximum value according to the envelope's y scale
+        mode: string, musx.envelopes interpolation mode, one of 'lin', 'cos', 'exp' or '-exp'
+        step: int, smallest change in control change value worth sending
+        grain: number, minimum timestep between control change messages
+
+    Yields:
+        number, timestep until the control change value next changes
+    """
+    changes = curve_changes(env, length, low=low, high=high, mode=mode, step=step, grain=grain)
+    prev_time = 0
+    for when, val in changes:
+        if when > prev_time:
+            yield when - prev_time
+            prev_time = when
+        _add_cc(queue.out, queue.now, chan, ctrl, val)
+
+
+def cc_ramp(queue, *, chan, ctrl, length, start, end, shape="exp", low=0, high=1, step=1, grain=0.01):
+    """Changes a control change value from start to end along a shaped curve.
+    Shorthand for cc_curve with a two point envelope, useful for fades and mix sweeps.
+
+    Arguments:
+        queue: musx Scheduler object, scheduler to add events to
+        chan: int (0-indexed), MIDI channel to send control change messages to
+        ctrl: int (0-indexed), control change number
+        length: number, total number of seconds for shift to take
+        start: number, starting value
+        end: number, ending value
+        shape: string, one of 'lin', 'exp', 'log' or 'scurve', defaults to exponential
+        low: number, minimum value according to start/end's scale
+        high: number, maximum value according to start/end's scale
+        step: int, smallest change in control change value worth sending
+        grain: number, minimum timestep between control change messages
+
+    Yields:
+        number, timestep until the control change value next changes
+
+    Raises:
+        ValueError: unknown curve shape
+    """
+    if shape not in curve_shapes:
+        raise ValueError("Specified curve shape '{}' is not in supported list of curve shapes: {}".format(shape, ', '.join(curve_shapes)))
+
+    yield from cc_curve(queue, chan=chan, ctrl=ctrl, length=length, env=[0, start, 1, end], low=low, high=high, mode=curve_shapes[shape], step=step, grain=grain)
+
+
 def cc_distribution(queue, *, chan, ctrl, length, rate, distribution=musx.uniran, low=0, high=1):
     """Changes a control change value according to a distribution.
     Generates a number from the distribution function, then remaps the value from low/high to 0/127.
@@ -148,9 +1116,9 @@ def cc_distribution(queue, *, chan, ctrl, length, rate, distribution=musx.uniran
     """
     start_time = queue.now
     while queue.now - start_time < length:
-        original = max(low, min(distribution(), high))
+        original = max(low, min(_draw(distribution), high))
         val = int(musx.rescale(original, low, high, 0, 127))
-        queue.out.addevent(musx.MidiEvent.control_change(chan, ctrl, val, time=queue.now))
+        _add_cc(queue.out, queue.now, chan, ctrl, val)
         yield rate
 
 
@@ -158,9 +1126,10 @@ def cc_distribution(queue, *, chan, ctrl, length, rate, distribution=musx.uniran
 # Note Generators #
 # --------------- #
 
-def distribution(queue, *, chan, length, notes, dur, distribution=musx.uniran, low=0, high=1):
+def distribution(queue, *, chan, length, notes, dur, distribution=musx.uniran, low=0, high=1, pregenerate=False):
     """Picks notes from a list according to distribution function.
     Generates a number from a distribution function, then remaps the value from low/high to a list index.
+    With pregenerate every note for the whole length is drawn with numpy and added in one batch.
 
     Arguments:
         queue: musx Scheduler object, scheduler to add events to
@@ -171,14 +1140,23 @@ def distribution(queue, *, chan, length, notes, dur, distribution=musx.uniran, l
         distribution: function, function whose returned number dictates the next note
         low: number, minimum value according to distribution's scale
         high: number, maximum value according to distribution's scale
+        pregenerate: boolean, whether to generate all notes up front in one batch (requires numpy), defaults to False
 
     Yields:
         number, timestep until next note should be selected and sent
     """
+    if pregenerate:
+        rng = _numpy_rng()
+        count = math.ceil(length / dur)
+        draws = np.clip(_draw_batch(distribution, count, rng), low, high)
+        selected = np.rint((draws - low) / (high - low) * (len(notes) - 1)).astype(np.int64)
+        _add_notes(queue.out, queue.now + np.arange(count) * dur, np.full(count, dur), np.asarray(notes)[selected], chan)
+        return
+
     start_time = queue.now
     while queue.now - start_time < length:
-        selected = round(musx.rescale(distribution(), low, high, 0, len(notes) - 1))
-        queue.out.addevent(musx.MidiNote(time=queue.now, dur=dur, key=notes[selected], chan=chan))
+        selected = round(musx.rescale(_draw(distribution), low, high, 0, len(notes) - 1))
+        _add_note(queue.out, queue.now, dur, notes[selected], chan)
         yield dur
 
 
@@ -199,22 +1177,78 @@ def euclidean_rhythm(queue, *, chan, length, keynum, events, positions, cycletim
     Yields:
         number, timestep until next note message should be sent
     """
-    sequence = bjorklund(events, positions)
+    mask = euclidean_mask(events, positions, rotation)
     start_time = queue.now
     notelen = cycletime / positions
-    i = rotation
+    i = 0
     while queue.now - start_time < length:
-        if sequence[i] == 1:
-            queue.out.addevent(musx.MidiNote(time=queue.now, dur=notelen, key=keynum, chan=chan))
+        if (mask >> i) & 1:
+            _add_note(queue.out, queue.now, notelen, keynum, chan)
         i += 1
         i %= positions
         yield notelen
 
 
-def random_ascend(queue, *, chan, length, notes, dur):
+def euclidean_ensemble(queue, *, length, patterns, cycletime):
+    """Plays many Euclidean rhythms off of a single clock.
+    Patterns sharing a number of positions are folded into one bitmask per step, so each step of the cycle knows
+    which patterns hit without checking any of them. Steps where nothing hits are skipped entirely, so the scheduler
+    only wakes up once per distinct onset rather than once per pattern per position.
+
+    Arguments:
+        queue: musx Scheduler object, scheduler to add events to
+        length: number, total number of seconds to generate messages for
+        patterns: list of tuples, each (keynum, events, positions, rotation, chan) as in euclidean_rhythm
+        cycletime: number, number of seconds a cycle should take, shared by every pattern
+
+    Yields:
+        number, timestep until the next onset of any pattern
+
+    Raises:
+        ValueError: no patterns, or a pattern has either zero events or more events than positions
+    """
+    if len(patterns) == 0:
+        raise ValueError("Must provide at least one pattern")
+
+    groups = {}
+    for keynum, events, positions, rotation, chan in patterns:
+        groups.setdefault(positions, []).append((euclidean_mask(events, positions, rotation), keynum, chan))
+
+    # Onsets are keyed by their exact fraction of the cycle so that shared onsets across position counts merge
+    onsets = {}
+    for positions, group in groups.items():
+        notelen = cycletime / positions
+        for i in range(positions):
+            hits = 0
+            for bit, (mask, _, _) in enumerate(group):
+                hits |= ((mask >> i) & 1) << bit
+            while hits:
+                bit = (hits & -hits).bit_length() - 1
+                onsets.setdefault(fractions.Fraction(i, positions), []).append((group[bit][1], group[bit][2], notelen))
+                hits &= hits - 1
+
+    table = [(float(offset) * cycletime, notes) for offset, notes in sorted(onsets.items())]
+    start_time = queue.now
+    cycle_start = 0
+    index = 0
+    while cycle_start + table[index][0] < length:
+        # Deltas are measured from the absolute onset time so that rounding does not drift over many cycles
+        delta = start_time + cycle_start + table[index][0] - queue.now
+        if delta > 0:
+            yield delta
+        for keynum, chan, notelen in table[index][1]:
+            _add_note(queue.out, queue.now, notelen, keynum, chan)
+        index += 1
+        if index == len(table):
+            index = 0
+            cycle_start += cycletime
+
+
+def random_ascend(queue, *, chan, length, notes, dur, pregenerate=False):
     """Plays a list of notes in an upward index trending random pattern.
     First third weights lower, second weights middle, third weights higher.
     Notes can spawn both in series and in parallel on each call.
+    With pregenerate the rhythms and notes for the whole length are drawn with numpy and added in one batch.
 
     Arguments:
         queue: musx Scheduler object, scheduler to add events to
@@ -222,11 +1256,36 @@ def random_ascend(queue, *, chan, length, notes, dur):
         length: number, total number of seconds to generate messages for
         notes: list of ints, list of MIDI note numbers to pick from
         dur: number, duration of each note in seconds
+        pregenerate: boolean, whether to generate all notes up front in one batch (requires numpy), defaults to False
         
     Yields:
         number, timestep until next note message should be sent
     """
-    rhythms = musx.choose([dur, [0, dur/2], [0, dur/4, dur/2, 3 * (dur/4)], [0, 3 * (dur/4)], [0, 0], [0, 0, dur/2, dur/2], [0, 0, 0]]) # repeated ones are a hack for triads
+    if pregenerate:
+        rng = _numpy_rng()
+        subdivisions = [[0], [0, dur/2], [0, dur/4, dur/2, 3 * (dur/4)], [0, 3 * (dur/4)], [0, 0], [0, 0, dur/2, dur/2], [0, 0, 0]]
+        flat_offsets = np.array([offset for rhythm in subdivisions for offset in rhythm])
+        sizes = np.array([len(rhythm) for rhythm in subdivisions])
+        firsts = np.cumsum(sizes) - sizes
+
+        # One rhythm per cycle, then every note of every rhythm is laid out flat
+        cycles = math.ceil(length / dur)
+        picked = rng.integers(0, len(subdivisions), cycles)
+        counts = sizes[picked]
+        cycle_of_note = np.repeat(np.arange(cycles), counts)
+        within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        cycle_starts = cycle_of_note * dur
+        offsets = cycle_starts + flat_offsets[firsts[picked][cycle_of_note] + within]
+
+        # Each note draws from lowran, midran or highran depending on which third its cycle starts in
+        pairs = rng.random((2, len(cycle_of_note)))
+        draws = np.select([cycle_starts < length * 0.33, cycle_starts < length * 0.66], [pairs.min(axis=0), pairs.mean(axis=0)], pairs.max(axis=0))
+        indices = np.minimum((draws * len(notes)).astype(np.int64), len(notes) - 1)
+
+        _add_notes(queue.out, queue.now + offsets, np.full(len(offsets), dur), np.asarray(notes)[indices], chan)
+        return
+
+    rhythms = _choose([dur, [0, dur/2], [0, dur/4, dur/2, 3 * (dur/4)], [0, 3 * (dur/4)], [0, 0], [0, 0, dur/2, dur/2], [0, 0, 0]]) # repeated ones are a hack for triads
     start_time = queue.now
     while queue.now - start_time < length:
         if queue.now - start_time < length * 0.33:
@@ -238,19 +1297,18 @@ def random_ascend(queue, *, chan, length, notes, dur):
 
         r = next(rhythms)
         if musx.isnum(r):
-            n = int(musx.rescale(ran_gen(), 0, 1, 0, len(notes)))
-            m = musx.MidiNote(time=queue.now, dur=dur, key=notes[n], chan=chan)
-            queue.out.addevent(m)
+            n = int(musx.rescale(_draw(ran_gen), 0, 1, 0, len(notes)))
+            _add_note(queue.out, queue.now, dur, notes[n], chan)
         else:
             for time in r:
-                n = int(musx.rescale(ran_gen(), 0, 1, 0, len(notes)))
-                m = musx.MidiNote(time=queue.now + time, dur=dur, key=notes[n], chan=chan)
-                queue.out.addevent(m)
+                n = int(musx.rescale(_draw(ran_gen), 0, 1, 0, len(notes)))
+                _add_note(queue.out, queue.now + time, dur, notes[n], chan)
         yield dur
 
-def drunk_walker(queue, *, chan, length, notes, dur, drunk_stride=2):
+def drunk_walker(queue, *, chan, length, notes, dur, drunk_stride=2, pregenerate=False):
     """Wrapper on musx's drunk generator to enable a track to drunkenly wander.
     If the generator falls out of bounds the index is reflected back into range.
+    With pregenerate the walk and durations for the whole length are drawn with numpy and added in one batch.
 
     Arguments:
         queue: musx Scheduler object, scheduler to add events to
@@ -258,14 +1316,865 @@ def drunk_walker(queue, *, chan, length, notes, dur, drunk_stride=2):
         length: number, total number of seconds to generate messages for
         notes: list of ints, list of MIDI note numbers to pick from
         dur: number, duration of each note in seconds, chance to be subdivided further
+        pregenerate: boolean, whether to generate all notes up front in one batch (requires numpy), defaults to False
         
     Yields:
         number, timestep until next note message should be sent
     """
-    drunk = musx.drunk(int(len(notes) / 2), 2)
-    durations = musx.choose([dur, dur/2, dur/4])
+    if pregenerate:
+        rng = _numpy_rng()
+        # Enough notes to fill length even if every duration is the shortest choice
+        count = math.ceil(length / (dur / 4)) + 1
+        durs = np.array([dur, dur/2, dur/4])[rng.integers(0, 3, count)]
+        offsets = np.cumsum(durs) - durs
+        count = int(np.searchsorted(offsets, length))
+        # Same walk as musx.drunk(int(len(notes) / 2), 2), which starts on its initial value
+        steps = rng.integers(-2, 3, count)
+        walk = int(len(notes) / 2) + np.cumsum(steps) - steps
+        indices = _reflect_batch(walk, 0, len(notes) - 1)
+        _add_notes(queue.out, queue.now + offsets[:count], durs[:count], np.asarray(notes)[indices], chan)
+        return
+
+    drunk = _drunk(int(len(notes) / 2), 2)
+    durations = _choose([dur, dur/2, dur/4])
     while queue.elapsed < length:
         picked_dur = next(durations)
-        index = musx.fit(next(drunk), 0, len(notes) - 1, mode='reflect')
-        queue.out.addevent(musx.MidiNote(time=queue.now, dur=picked_dur, key=notes[index], chan=chan))
-        yield picked_dur
\ No newline at end of file
+        index = musx.fit(int(next(drunk)), 0, len(notes) - 1, mode='reflect')
+        _add_note(queue.out, queue.now, picked_dur, notes[index], chan)
+        yield picked_dur
+
+
+
+# ---------------- #
+# Clock Generators #
+# ---------------- #
+
+def midi_clock(queue, *, length, tempo=60, transport=True):
+    """Sends MIDI Beat Clock (24 pulses per quarter note) so a DAW can follow the composition's tempo.
+    The whole tick schedule is computed up front as start + i * period, so ticks never drift from the note grid,
+    and is added to the same output as the notes, so live playback times both against one clock.
+
+    Arguments:
+        queue: musx Scheduler object, scheduler to add events to
+        length: number, total number of seconds to send clock for
+        tempo: number, quarter-note tempo in beats per minute, defaults to musx's 60 bpm
+        transport: boolean, whether to send start before the first tick and stop after the last, defaults to True
+
+    Raises:
+        ValueError: tempo is not positive
+
+    Yields:
+        nothing, yields zero to satisfy requirements for musx Scheduler.
+    """
+    if tempo <= 0:
+        raise ValueError("Invalid tempo '{}', must be positive".format(tempo))
+
+    period = 60 / (tempo * 24)
+    start = queue.now
+    for tick in range(math.ceil(length / period)):
+        _add_message(queue.out, start + tick * period, [rtmidi.midiconstants.TIMING_CLOCK])
+    if transport:
+        # Added after the first tick, musx.MidiSeq.addevent puts it ahead of same time events and _tie_rank ranks it first
+        _add_message(queue.out, start, [rtmidi.midiconstants.SONG_START])
+        _add_message(queue.out, start + length, [rtmidi.midiconstants.SONG_STOP])
+    yield 0
+
+
+def midi_time_code(queue, *, length, fps=30, offset=0, full_frame=True):
+    """Sends MIDI Time Code quarter frames so a DAW can chase the composition's position.
+    Four quarter frames are sent per frame and eight make up one full time, each group of eight carrying the time
+    of the frame its first message was sent on. Like midi_clock the schedule is computed up front.
+
+    Arguments:
+        queue: musx Scheduler object, scheduler to add events to
+        length: number, total number of seconds to send time code for
+        fps: int, frame rate, one of 24, 25 or 30, defaults to 30
+        offset: number, time code in seconds that the scheduler's current time corresponds to, defaults to 0
+        full_frame: boolean, whether to send a full frame sysex first so the receiver locates before chasing, defaults to True
+
+    Raises:
+        ValueError: fps is not a supported frame rate
+
+    Yields:
+        nothing, yields zero to satisfy requirements for musx Scheduler.
+    """
+    if fps not in mtc_rates:
+        raise ValueError("Invalid frame rate '{}', valid rates are {}".format(fps, list(mtc_rates)))
+
+    period = 1 / (fps * 4)
+    start = queue.now
+    first_frame = round(offset * fps)
+    first_frame -= first_frame % 2
+    messages = []
+    for quarter in range(math.ceil(length / period)):
+        if quarter % 8 == 0:
+            messages = _mtc_pieces(first_frame + quarter // 4, fps)
+        _add_message(queue.out, start + quarter * period, messages[quarter % 8])
+    if full_frame:
+        # Added after the first quarter frame for the same reason as midi_clock's start
+        hours, minutes, seconds, frames = _mtc_fields(first_frame, fps)
+        _add_message(queue.out, start, [0xF0, 0x7F, 0x7F, 0x01, 0x01, (mtc_rates[fps] << 5) | hours, minutes, seconds, frames, 0xF7])
+    yield 0
+
+
+
+# ------------------- #
+# Compact Event Store #
+# ------------------- #
+
+class EventBuffer:
+    """Scheduler output that stores events as a struct of arrays instead of as musx objects.
+    Each row is one note or message: time (float64), status, data1, data2 (uint8), dur (float64) and whether the row
+    is a note (uint8). Note rows always get a note-off, even with a dur of 0.
+    A musx MidiSeq is only built when something asks for one, and is reused until more events are added.
+    Sysex and meta events don't fit in a row, so they are kept aside as the MidiEvents they arrived as.
+
+    Example:
+        buf = musx_reaper.EventBuffer()
+        queue = musx.Scheduler(out=buf)
+        queue.compose(...)
+        buf.play(midiout, False)
+    """
+
+    def __init__(self):
+        self.times = array.array("d")
+        self.status = array.array("B")
+        self.data1 = array.array("B")
+        self.data2 = array.array("B")
+        self.durs = array.array("d")
+        self.notes = array.array("B")
+        self.extra = []
+        self._seq = None
+
+    def __len__(self):
+        return len(self.times) + len(self.extra)
+
+    def _append(self, time, status, data1, data2, dur, note=False):
+        self.times.append(time)
+        self.status.append(status)
+        self.data1.append(data1)
+        self.data2.append(data2)
+        self.durs.append(dur)
+        self.notes.append(note)
+        self._seq = None
+
+    def addnote(self, time, dur, key, chan, amp=0.5):
+        """Adds a note as a single row, its note-off is implied by dur.
+
+        Arguments:
+            time: number, start time in seconds
+            dur: number, duration in seconds
+            key: int, MIDI note number
+            chan: int (0-indexed), MIDI channel
+            amp: number, amplitude 0-1 scaled to velocity like musx.MidiNote, or a velocity above 1
+        """
+        self._append(time, 0x90 | chan, int(key), int(amp * 127) if amp <= 1 else int(amp), dur, True)
+
+    def addcc(self, time, chan, ctrl, val):
+        """Adds a control change message.
+
+        Arguments:
+            time: number, time in seconds
+            chan: int (0-indexed), MIDI channel
+            ctrl: int (0-indexed), control change number
+            val: int, control change value
+        """
+        self._append(time, 0xB0 | chan, ctrl, val, 0)
+
+    def addnotes(self, times, durs, keys, chan, amp=0.5):
+        """Adds a batch of notes straight from numpy arrays.
+
+        Arguments:
+            times: numpy array of numbers, start times in seconds
+            durs: numpy array of numbers, durations in seconds
+            keys: numpy array of ints, MIDI note numbers
+            chan: int (0-indexed), MIDI channel
+            amp: number, amplitude 0-1 scaled to velocity like musx.MidiNote, or a velocity above 1
+        """
+        count = len(times)
+        self.times.frombytes(np.asarray(times, dtype=np.float64).tobytes())
+        self.status.frombytes(bytes([0x90 | chan]) * count)
+        self.data1.frombytes(np.asarray(keys, dtype=np.uint8).tobytes())
+        self.data2.frombytes(bytes([int(amp * 127) if amp <= 1 else int(amp)]) * count)
+        self.durs.frombytes(np.asarray(durs, dtype=np.float64).tobytes())
+        self.notes.frombytes(b"\x01" * count)
+        self._seq = None
+
+    def addevent(self, event):
+        """Adds a musx MidiNote or MidiEvent, so composers that write to queue.out directly still work.
+
+        Arguments:
+            event: musx MidiNote or MidiEvent object
+        """
+        if isinstance(event, musx.MidiNote):
+            self.addnote(event.time, event.dur, event.key, event.chan, event.amp)
+            return
+
+        message = event.message
+        if len(message) > 3 or message[0] in (0xF0, 0xFF):
+            self.extra.append(event)
+            self._seq = None
+            return
+        self.addmessage(event.time, message)
+
+    def addmessage(self, time, message):
+        """Adds a raw MIDI message, e.g. a clock tick or time code quarter frame.
+
+        Arguments:
+            time: number, time in seconds
+            message: list of ints, the message bytes
+        """
+        if len(message) > 3 or message[0] in (0xF0, 0xFF):
+            self.extra.append(musx.MidiEvent(message, time=time))
+            self._seq = None
+            return
+        self._append(time, message[0], message[1] if len(message) > 1 else 0, message[2] if len(message) > 2 else 0, 0)
+
+    def clear(self):
+        """Removes all events from the buffer.
+        """
+        for column in (self.times, self.status, self.data1, self.data2, self.durs, self.notes):
+            del column[:]
+        self.extra.clear()
+        self._seq = None
+
+    def toseq(self):
+        """Converts the buffer into a time sorted musx MidiSeq.
+        Ties are ordered note-offs first and note-ons last, like musx.MidiSeq.addevent, see _tie_rank.
+
+        Returns:
+            musx MidiSeq object, cached until more events are added
+        """
+        if self._seq is not None:
+            return self._seq
+
+        ranked = []
+        onsets = sorted(set(self.times))
+        for i in range(len(self.times)):
+            status = self.status[i]
+            message = [status, self.data1[i], self.data2[i]][:_message_length(status)]
+            if self.notes[i]:
+                off_time = _snap(self.times[i] + self.durs[i], onsets)
+                ranked.append((self.times[i], _NOTE_ON_RANK, i, message))
+                ranked.append((off_time, _off_rank(self.times[i], off_time), i, [0x80 | (status & 0x0F), self.data1[i], 127]))
+            else:
+                ranked.append((self.times[i], _tie_rank(status, self.data2[i]), i, message))
+        # Sysex and meta events are ranked along with the rows, after any row of the same rank and time
+        for j, event in enumerate(self.extra):
+            ranked.append((event.time, _tie_rank(event.message[0], 0), len(self.times) + j, event))
+        ranked.sort(key=lambda item: item[:3])
+
+        events = [item if isinstance(item, musx.MidiEvent) else musx.MidiEvent(item, time=when) for when, _, _, item in ranked]
+
+        self._seq = musx.MidiSeq(events)
+        return self._seq
+
+    def play(self, port, block=True):
+        """Plays the buffer out an open rtmidi output port, see musx.MidiSeq.play.
+
+        Arguments:
+            port: rtmidi MidiOut object, port to play through
+            block: boolean, whether to block for the duration of the playback
+        """
+        self.toseq().play(port, block)
+
+
+# ----------------- #
+# Offline Rendering #
+# ----------------- #
+
+class MidiFileWriter:
+    """Scheduler output that encodes events straight into Standard MIDI File track data.
+    Each event is packed into a single int sort key when it is added, no MidiNote or MidiEvent objects are made.
+    Events are split into one track per channel, with a tempo track in front, and written as a level 1 file.
+    Non-channel messages (sysex, system common and realtime) cannot be stored in a track and are dropped.
+
+    Arguments:
+        path: string, filepath to write the MIDI file to
+        tempo: number, quarter-note tempo of the file, defaults to musx's 60 bpm so that beats are seconds
+        divs: int, ticks per quarter note, defaults to 480
+    """
+
+    def __init__(self, path, *, tempo=60, divs=480):
+        self.path = path
+        self.tempo = tempo
+        self.divs = divs
+        self.count = 0
+        self._ticks_per_second = divs * tempo / 60
+        self._tracks = {}
+
+    def __len__(self):
+        return self.count
+
+    def _add(self, time, rank, status, data1, data2):
+        tick = round(time * self._ticks_per_second)
+        # tick | rank | insertion order | message bytes, so a plain int sort gives a stable track order
+        key = ((((tick * 4 + rank) << 40) | self.count) << 24) | (status << 16) | (data1 << 8) | data2
+        self._tracks.setdefault(status & 0x0F, []).append(key)
+        self.count += 1
+
+    def _note(self, time, dur, chan, key, velocity):
+        on_tick = round(time * self._ticks_per_second)
+        off_tick = round((time + dur) * self._ticks_per_second)
+        self._add(time, _NOTE_ON_RANK, 0x90 | chan, key, velocity)
+        self._add(time + dur, _off_rank(on_tick, off_tick), 0x80 | chan, key, 127)
+
+    def addnote(self, time, dur, key, chan, amp=0.5):
+        """Adds a note as a note-on/note-off pair.
+
+        Arguments:
+            time: number, start time in seconds
+            dur: number, duration in seconds
+            key: int, MIDI note number
+            chan: int (0-indexed), MIDI channel
+            amp: number, amplitude 0-1 scaled to velocity like musx.MidiNote, or a velocity above 1
+        """
+        self._note(time, dur, chan, int(key), int(amp * 127) if amp <= 1 else int(amp))
+
+    def addcc(self, time, chan, ctrl, val):
+        """Adds a control change message.
+
+        Arguments:
+            time: number, time in seconds
+            chan: int (0-indexed), MIDI channel
+            ctrl: int (0-indexed), control change number
+            val: int, control change value
+        """
+        self._add(time, _OTHER_RANK, 0xB0 | chan, ctrl, val)
+
+    def addevent(self, event):
+        """Adds a musx MidiNote or MidiEvent, so composers that write to queue.out directly still work.
+
+        Arguments:
+            event: musx MidiNote or MidiEvent object
+        """
+        if isinstance(event, musx.MidiNote):
+            self.addnote(event.time, event.dur, event.key, event.chan, event.amp)
+            return
+
+        self.addmessage(event.time, event.message)
+
+    def addmessage(self, time, message):
+        """Adds a raw MIDI message, system messages such as clock and time code are dropped.
+
+        Arguments:
+            time: number, time in seconds
+            message: list of ints, the message bytes
+        """
+        status = message[0]
+        if status < 0x80 or status >= 0xF0:
+            return
+        data1 = message[1] if len(message) > 1 else 0
+        data2 = message[2] if len(message) > 2 else 0
+        self._add(time, _tie_rank(status, data2), status, data1, data2)
+
+    def addbuffer(self, buffer):
+        """Adds every event held in an EventBuffer.
+
+        Arguments:
+            buffer: EventBuffer object, events to add
+        """
+        for i in range(len(buffer.times)):
+            status = buffer.status[i]
+            if buffer.notes[i]:
+                self._note(buffer.times[i], buffer.durs[i], status & 0x0F, buffer.data1[i], buffer.data2[i])
+            elif status < 0xF0:
+                self._add(buffer.times[i], _tie_rank(status, buffer.data2[i]), status, buffer.data1[i], buffer.data2[i])
+        for event in buffer.extra:
+            self.addevent(event)
+
+    def _track_bytes(self, keys):
+        """Sorts one track's packed events and delta-time encodes them into an MTrk chunk.
+        """
+        data = bytearray()
+        prev_tick = 0
+        for key in sorted(keys):
+            tick = (key >> 64) // 4
+            status = (key >> 16) & 0xFF
+            data += _varlen(tick - prev_tick)
+            data.append(status)
+            data.append((key >> 8) & 0xFF)
+            if _message_length(status) == 3:
+                data.append(key & 0xFF)
+            prev_tick = tick
+        data += b"\x00\xFF\x2F\x00"
+        return b"MTrk" + len(data).to_bytes(4, "big") + bytes(data)
+
+    def write(self):
+        """Writes the header, tempo track and channel tracks to path.
+
+        Returns:
+            the MidiFileWriter, for chaining
+        """
+        usecs = round(60000000 / self.tempo)
+        tempo_track = b"\x00\xFF\x51\x03" + usecs.to_bytes(3, "big") + b"\x00\xFF\x2F\x00"
+        chunks = [b"MTrk" + len(tempo_track).to_bytes(4, "big") + tempo_track]
+        for chan in sorted(self._tracks):
+            chunks.append(self._track_bytes(self._tracks[chan]))
+
+        with open(self.path, "wb") as midi_file:
+            midi_file.write(b"MThd" + (6).to_bytes(4, "big") + (1).to_bytes(2, "big") + len(chunks).to_bytes(2, "big") + self.divs.to_bytes(2, "big"))
+            for chunk in chunks:
+                midi_file.write(chunk)
+        return self
+
+
+def render_midifile(path, composition, *, tempo=60, divs=480):
+    """Renders a composition offline straight to a Standard MIDI File.
+    The musx Scheduler already runs composers on a virtual clock, so this swaps its output for a MidiFileWriter
+    and skips building a MidiSeq of MidiNote/MidiEvent objects altogether.
+
+    Arguments:
+        path: string, filepath to write the MIDI file to
+        composition: function, takes the scheduler and returns what to pass to queue.compose,
+            e.g. lambda queue: [[0, cc_init(queue)], [0, ukulele(queue)]]
+        tempo: number, quarter-note tempo of the file, defaults to musx's 60 bpm
+        divs: int, ticks per quarter note, defaults to 480
+
+    Returns:
+        MidiFileWriter object, the written file's writer, len() of which is the number of events written
+    """
+    writer = MidiFileWriter(path, tempo=tempo, divs=divs)
+    queue = musx.Scheduler(out=writer)
+    queue.compose(composition(queue))
+    return writer.write()
+
+
+
+# ------------- #
+# Live Playback #
+# ------------- #
+
+class Player:
+    """Plays a sequence out a port in real time on a background thread.
+    This is the counterpart of musx.MidiSeq.play for ports that aren't an rtmidi MidiOut, e.g. a TrackedPort,
+    since MidiSeq.play refuses anything else. Events are timed against absolute deadlines so that sleep overshoot
+    does not accumulate. Stopping, or an exception while sending, releases notes left sounding on a TrackedPort.
+    Once running, started holds the time.perf_counter() value that event time zero maps to.
+
+    Arguments:
+        seq: musx MidiSeq or EventBuffer object, events to play
+        port: object with a send_message method, port to play through
+    """
+
+    def __init__(self, seq, port):
+        if isinstance(seq, EventBuffer):
+            seq = seq.toseq()
+        self.events = [(event.time, event.message) for event in seq]
+        self.port = port
+        self.started = None
+        self.sent = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        self.started = start = time.perf_counter()
+        try:
+            for when, message in self.events:
+                delay = start + when - time.perf_counter()
+                if delay > 0 and self._stop.wait(delay):
+                    break
+                if self._stop.is_set():
+                    break
+                self.port.send_message(message)
+                self.sent += 1
+        finally:
+            if isinstance(self.port, TrackedPort):
+                self.port.release()
+
+    def start(self):
+        """Starts playback on a background thread.
+
+        Returns:
+            the Player, for chaining
+        """
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops playback and waits for the playback thread to release its notes.
+        """
+        self._stop.set()
+        self.wait()
+
+    def wait(self):
+        """Blocks until playback has finished.
+        """
+        if self._thread is not None:
+            self._thread.join()
+
+
+def play(seq, port, block=True):
+    """Plays a sequence out a port, see Player.
+
+    Arguments:
+        seq: musx MidiSeq or EventBuffer object, events to play
+        port: object with a send_message method, port to play through
+        block: boolean, whether to block for the duration of the playback, defaults to True
+
+    Returns:
+        Player object, the running (or finished) player
+    """
+    player = Player(seq, port).start()
+    if block:
+        player.wait()
+    return player
+
+
+
+# -------------- #
+# Async Playback #
+# -------------- #
+
+class AsyncPlayer:
+    """Live playback engine for asyncio programs.
+    Composer coroutines run on the event loop and write messages ahead of time, a dispatcher thread sends them from a
+    heap of absolute deadlines. A busy event loop therefore only delays composing, not sending, as long as it falls
+    behind by less than the lookahead. Composers count time in beats, tempo and density can be changed at any time
+    and take effect from the next message composed.
+
+    Arguments:
+        port: object with a send_message method, port to play through
+        tempo: number, beats per minute, defaults to musx's 60 so that beats are seconds
+        density: number, multiplier on how often the note coroutines play, defaults to 1
+        lookahead: number, seconds ahead of their deadline that messages are composed, defaults to 0.05
+
+    Example:
+        async with musx_reaper.AsyncPlayer(midiout) as player:
+            await asyncio.gather(musx_reaper.async_cc_linear(player, chan=0, ctrl=1, length=8, start=0, end=1),
+                                 musx_reaper.async_distribution(player, chan=0, length=8, notes=notes, dur=0.25))
+    """
+
+    def __init__(self, port, *, tempo=60, density=1, lookahead=0.05):
+        self.port = port
+        self.density = density
+        self.lookahead = lookahead
+        self._tempo = tempo
+        self._anchor_beat = 0.0
+        self._anchor_wall = None
+        self._heap = []
+        self._count = 0
+        self._condition = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    async def __aenter__(self):
+        return self.start()
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await asyncio.get_running_loop().run_in_executor(None, self.stop)
+        return False
+
+    @property
+    def tempo(self):
+        return self._tempo
+
+    @tempo.setter
+    def tempo(self, tempo):
+        if tempo <= 0:
+            raise ValueError("Invalid tempo '{}', must be positive".format(tempo))
+        if self._anchor_wall is not None:
+            self._anchor_beat = self.now()
+            self._anchor_wall = time.perf_counter()
+        self._tempo = tempo
+
+    def _check_started(self):
+        if self._anchor_wall is None:
+            raise ValueError("AsyncPlayer has not been started, call start() or use it in an async with block")
+
+    def now(self):
+        """Current time in beats since start.
+
+        Raises:
+            ValueError: player has not been started
+        """
+        self._check_started()
+        return self._anchor_beat + (time.perf_counter() - self._anchor_wall) * self._tempo / 60
+
+    def deadline(self, beat):
+        """Converts a time in beats to a time.perf_counter() deadline at the current tempo.
+
+        Raises:
+            ValueError: player has not been started
+        """
+        self._check_started()
+        return self._anchor_wall + (beat - self._anchor_beat) * 60 / self._tempo
+
+    def start(self):
+        """Starts the clock and the dispatcher thread.
+
+        Returns:
+            the AsyncPlayer, for chaining
+        """
+        self._anchor_wall = time.perf_counter()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops the dispatcher, dropping anything not yet sent except note-offs, so no note is left hanging.
+        Notes left sounding on a TrackedPort are released by the port instead.
+        """
+        with self._condition:
+            self._running = False
+            pending = [message for _, _, message in sorted(self._heap)]
+            self._heap.clear()
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+        if isinstance(self.port, TrackedPort):
+            self.port.release()
+            return
+        for message in pending:
+            if _tie_rank(message[0], message[2] if len(message) > 2 else 0) == _NOTE_OFF_RANK:
+                self.port.send_message(message)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._running:
+                    if not self._heap:
+                        self._condition.wait()
+                        continue
+                    delay = self._heap[0][0] - time.perf_counter()
+                    if delay <= 0:
+                        break
+                    self._condition.wait(delay)
+                if not self._running:
+                    return
+                _, _, message = heapq.heappop(self._heap)
+            self.port.send_message(message)
+
+    def send(self, beat, message):
+        """Schedules a message.
+
+        Arguments:
+            beat: number, time in beats to send at
+            message: list of ints, MIDI message bytes
+        """
+        with self._condition:
+            heapq.heappush(self._heap, (self.deadline(beat), self._count, message))
+            self._count += 1
+            self._condition.notify()
+
+    def note(self, beat, dur, key, chan, amp=0.5):
+        """Schedules a note-on and its note-off.
+
+        Arguments:
+            beat: number, start time in beats
+            dur: number, duration in beats
+            key: int, MIDI note number
+            chan: int (0-indexed), MIDI channel
+            amp: number, amplitude 0-1 scaled to velocity like musx.MidiNote, or a velocity above 1
+        """
+        self.send(beat, [0x90 | chan, int(key), int(amp * 127) if amp <= 1 else int(amp)])
+        self.send(beat + dur, [0x80 | chan, int(key), 127])
+
+    async def wait(self, beat):
+        """Sleeps until lookahead seconds before beat, rechecking the deadline so that tempo changes are followed.
+
+        Arguments:
+            beat: number, time in beats to compose for
+        """
+        while True:
+            delay = self.deadline(beat) - self.lookahead - time.perf_counter()
+            if delay <= 0:
+                return
+            await asyncio.sleep(min(delay, self.lookahead))
+
+
+async def async_cc_linear(player, *, chan, ctrl, length, start, end, low=0, high=1, grain=0.05):
+    """cc_linear for an AsyncPlayer, length and grain are in beats.
+    Remaps the start/end from low/high to 0-127, then evenly spaces out the changes according to a grain resolution.
+
+    Arguments:
+        player: AsyncPlayer object, player to schedule messages on
+        chan: int (0-indexed), MIDI channel to send control change messages to
+        ctrl: int (0-indexed), control change number
+        length: number, total number of beats for shift to take
+        start: number, starting value
+        end: number, ending value
+        low: number, minimum value according to start/end's scale
+        high: number, maximum value according to start/end's scale
+        grain: number, beats between control change messages
+    """
+    begin = player.now()
+    start_rescale = musx.rescale(start, low, high, 0, 127)
+    end_rescale = musx.rescale(end, low, high, 0, 127)
+    # A length shorter than half a grain still sends the start and end values
+    steps = max(1, round(length / grain))
+    for i in range(steps + 1):
+        beat = begin + i * grain
+        await player.wait(beat)
+        player.send(beat, [0xB0 | chan, ctrl, round(start_rescale + (end_rescale - start_rescale) * i / steps)])
+
+
+async def async_cc_distribution(player, *, chan, ctrl, length, rate, distribution=musx.uniran, low=0, high=1):
+    """cc_distribution for an AsyncPlayer, length and rate are in beats.
+    Generates a number from the distribution function, then remaps the value from low/high to 0/127.
+
+    Arguments:
+        player: AsyncPlayer object, player to schedule messages on
+        chan: int (0-indexed), MIDI channel to send control change messages to
+        ctrl: int (0-indexed), control change number
+        length: number, total number of beats active
+        rate: number, how frequently the control change value should be generated in beats
+        distribution: function, function whose returned number dictates the next control change value
+        low: number, minimum value according to distribution's scale
+        high: number, maximum value according to distribution's scale
+    """
+    begin = beat = player.now()
+    while beat - begin < length:
+        await player.wait(beat)
+        original = max(low, min(_draw(distribution), high))
+        player.send(beat, [0xB0 | chan, ctrl, int(musx.rescale(original, low, high, 0, 127))])
+        beat += rate
+
+
+async def async_distribution(player, *, chan, length, notes, dur, distribution=musx.uniran, low=0, high=1):
+    """distribution for an AsyncPlayer, length and dur are in beats.
+    Notes follow the player's density, at density 2 they come twice as often and last half as long.
+
+    Arguments:
+        player: AsyncPlayer object, player to schedule messages on
+        chan: int (0-indexed), MIDI channel to send note messages to
+        length: number, total number of beats to generate messages for
+        notes: list of ints, list of MIDI note numbers to pick from
+        dur: number, duration of each note in beats at density 1
+        distribution: function, function whose returned number dictates the next note
+        low: number, minimum value according to distribution's scale
+        high: number, maximum value according to distribution's scale
+    """
+    begin = beat = player.now()
+    while beat - begin < length:
+        await player.wait(beat)
+        step = dur / player.density
+        selected = round(musx.rescale(_draw(distribution), low, high, 0, len(notes) - 1))
+        player.note(beat, step, notes[selected], chan)
+        beat += step
+
+
+
+# --------- #
+# Profiling #
+# --------- #
+
+class Profiler:
+    """Measures how much time each composer in a queue.compose tree takes.
+    Wrapped generators are timed on every resume: wall and CPU time, events added to queue.out and the number of
+    other wrapped composers waiting to be resumed, counted by the profiler itself from when they are wrapped until
+    they finish (unwrapped composers are not counted). Works for any generator, musx_images walkers included.
+    A disabled profiler hands generators back unwrapped, so leaving the calls in costs nothing.
+
+    Arguments:
+        queue: musx Scheduler object, scheduler the wrapped generators run on
+        enabled: boolean, whether to profile at all, defaults to True
+
+    Example:
+        prof = musx_reaper.Profiler(queue)
+        queue.compose([[0, prof.wrap(ukulele(queue))], [5, prof.wrap(flicks(queue), "flicks")]])
+        prof.write_chrome_trace("render.json")
+    """
+
+    def __init__(self, queue, *, enabled=True):
+        self.queue = queue
+        self.enabled = enabled
+        self.origin = time.perf_counter()
+        # One row per resume: name, wall start, wall time, CPU time (seconds), events emitted, composers waiting, scheduler time
+        self.records = []
+        self._wrapped = 0
+
+    def wrap(self, generator, name=None):
+        """Wraps a composer generator so its resumes are recorded.
+
+        Arguments:
+            generator: generator object, composer to profile
+            name: string, name to report it under, defaults to the generator function's name
+
+        Returns:
+            generator object, the profiled generator, or the one passed in if profiling is disabled
+        """
+        if not self.enabled:
+            return generator
+        self._wrapped += 1
+        return self._profiled(generator, name or generator.__name__)
+
+    def _profiled(self, generator, name):
+        queue = self.queue
+        records = self.records
+        try:
+            while True:
+                events = _event_count(queue.out)
+                waiting = self._wrapped - 1
+                now = queue.now
+                cpu_start = time.thread_time()
+                wall_start = time.perf_counter()
+                finished = False
+                try:
+                    delta = next(generator)
+                except StopIteration:
+                    finished = True
+                wall_end = time.perf_counter()
+                cpu_end = time.thread_time()
+                records.append((name, wall_start - self.origin, wall_end - wall_start, cpu_end - cpu_start, _event_count(queue.out) - events, waiting, now))
+                if finished:
+                    return
+                yield delta
+        finally:
+            self._wrapped -= 1
+
+    def summary(self):
+        """Totals the records per generator.
+
+        Returns:
+            dictionary of name to a dictionary of resumes, wall and cpu (seconds) and events, slowest first
+        """
+        totals = {}
+        for name, _, wall, cpu, events, _, _ in self.records:
+            total = totals.setdefault(name, {"resumes": 0, "wall": 0.0, "cpu": 0.0, "events": 0})
+            total["resumes"] += 1
+            total["wall"] += wall
+            total["cpu"] += cpu
+            total["events"] += events
+        return dict(sorted(totals.items(), key=lambda item: item[1]["wall"], reverse=True))
+
+    def chrome_trace(self):
+        """Builds a Chrome trace (chrome://tracing, Perfetto) with one slice per resume and a counter of waiting composers.
+
+        Returns:
+            dictionary in the Trace Event Format, ready for json.dump
+        """
+        trace = []
+        for name, start, wall, cpu, events, waiting, now in self.records:
+            trace.append({"name": name, "ph": "X", "pid": 0, "tid": 0, "ts": start * 1e6, "dur": wall * 1e6,
+                          "args": {"cpu_us": cpu * 1e6, "events": events, "scheduler_time": now}})
+            trace.append({"name": "waiting composers", "ph": "C", "pid": 0, "ts": start * 1e6, "args": {"count": waiting}})
+        return {"traceEvents": trace, "displayTimeUnit": "ms"}
+
+    def write_chrome_trace(self, path):
+        """Writes chrome_trace to a JSON file.
+
+        Arguments:
+            path: string, filepath to write to
+        """
+        with open(path, "w") as trace_file:
+            json.dump(self.chrome_trace(), trace_file)
+
+    def folded(self):
+        """Builds folded stacks, the input format of flamegraph.pl and speedscope, weighted by wall time in microseconds.
+
+        Returns:
+            string, one "compose;name microseconds" line per generator
+        """
+        return "".join("compose;{} {}\n".format(name, round(total["wall"] * 1e6)) for name, total in self.summary().items())
+
+    def write_folded(self, path):
+        """Writes folded to a text file.
+
+        Arguments:
+            path: string, filepath to write to
+        """
+        with open(path, "w") as folded_file:
+            folded_file.write(self.folded())